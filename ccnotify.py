@@ -10,27 +10,572 @@ https://github.com/dazuiba/CCNotify
 
 import os
 import sys
-import json
-import sqlite3
-import subprocess
-import logging
-from logging.handlers import TimedRotatingFileHandler
-from datetime import datetime
+import time
+from contextlib import contextmanager, nullcontext
+
+
+def _lazy_import(name):
+    """Module whose import runs on first attribute access.
+
+    Hooks answered by the daemon, the "ok" probe and invalid hook types
+    never touch logging or json, so they must not pay for importing them.
+    Modules only a few functions need (sqlite3, subprocess, datetime) are
+    imported inside those functions instead.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    import importlib.util
+
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+json = _lazy_import("json")
+logging = _lazy_import("logging")
+
+VALID_EVENTS = ["UserPromptSubmit", "Stop", "Notification"]
+SOCKET_NAME = "ccnotify.sock"
+CONFIG_NAME = "ccnotify.json"
+# Hook events that could not be stored, replayable with `ccnotify.py ingest`
+FAILED_EVENTS_NAME = "failed-events.jsonl"
+# Append-only event journal used when "journal" is enabled
+JOURNAL_NAME = "events.journal"
+JOURNAL_HEADER = b"#ccnotify-journal "
+# A fully folded journal is removed once it has grown past this size
+JOURNAL_COMPACT_BYTES = 1 << 20
+# Journal records older than this (seconds) are folded without notifying
+JOURNAL_NOTIFY_MAX_AGE = 300
+
+# Bump whenever init_database() changes, so existing files are migrated
+SCHEMA_VERSION = 1
+
+# "database is locked" handling: SQLite's own busy wait per attempt (ms),
+# then up to LOCK_RETRIES attempts separated by a random sleep of at most
+# LOCK_BACKOFF * 2**attempt seconds (capped at LOCK_BACKOFF_MAX) so that
+# many blocked hooks do not retry in lockstep
+BUSY_TIMEOUT_MS = 1000
+LOCK_RETRIES = 6
+LOCK_BACKOFF = 0.05
+LOCK_BACKOFF_MAX = 1.0
+
+DEFAULT_CONFIG = {
+    # Seconds a detected click-target environment is reused for a session
+    "env_cache_ttl": 600,
+    # "sync" runs terminal-notifier inside the hook; "queue" hands it to a
+    # detached delivery worker so the hook returns immediately
+    "delivery": "sync",
+    # Delivery attempts per queued notification before it is marked failed
+    "delivery_max_attempts": 3,
+    # Days of full prompt rows to keep; older rows are folded into
+    # prompt_daily and deleted.  0 keeps everything.
+    "retention_days": 0,
+    # Record per-phase timings of every hook event in event_timing
+    "timing": True,
+    # Hooks append events to an append-only journal and exit; a background
+    # `ccnotify.py fold` applies them to the database
+    "journal": False,
+}
+
+# Phases timed per hook event; each is stored as <phase>_us in event_timing
+TIMING_PHASES = ("parse", "validate", "init", "db", "env", "notify")
+
+
+def get_data_dir():
+    """Directory holding the database, log and daemon socket"""
+    return os.environ.get("CCNOTIFY_HOME") or os.path.dirname(
+        os.path.abspath(__file__)
+    )
+
+
+def load_config():
+    """Return DEFAULT_CONFIG overlaid with ccnotify.json from the data directory"""
+    config = dict(DEFAULT_CONFIG)
+    config_path = os.path.join(get_data_dir(), CONFIG_NAME)
+    try:
+        with open(config_path, encoding="utf-8") as f:
+            config.update(json.load(f))
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as e:
+        logging.warning(f"Ignoring unreadable config {config_path}: {e}")
+    return config
+
+
+# Hot-path queries; each must stay an index search (see TestQueryPlans)
+LATEST_OPEN_PROMPT_SQL = """
+    SELECT id, created_at, cwd
+    FROM prompt
+    WHERE session_id = ? AND stoped_at IS NULL
+    ORDER BY created_at DESC
+    LIMIT 1
+"""
+
+MARK_WAITING_SQL = """
+    UPDATE prompt
+    SET lastWaitUserAt = COALESCE(?, CURRENT_TIMESTAMP)
+    WHERE id = (
+        SELECT id FROM prompt
+        WHERE session_id = ?
+        ORDER BY created_at DESC
+        LIMIT 1
+    )
+"""
+
+# Upper bounds (seconds) of the duration histogram buckets kept per day and
+# project; durations above the last bound fall into one overflow bucket
+DURATION_BUCKETS = [
+    5, 10, 20, 30, 45, 60, 90, 120, 180, 240, 300, 420, 600, 900, 1200,
+    1800, 2700, 3600, 5400, 7200, 10800, 14400, 21600, 43200, 86400,
+]
+
+# Per-job metrics feeding the prompt_daily rollups; {where} selects the jobs
+JOB_METRICS_SQL = """
+    SELECT date(created_at, 'localtime') AS day,
+           COALESCE(cwd, '') AS cwd,
+           MAX(0, strftime('%s', stoped_at) - strftime('%s', created_at)) AS duration,
+           CASE WHEN lastWaitUserAt BETWEEN created_at AND stoped_at
+                THEN strftime('%s', stoped_at) - strftime('%s', lastWaitUserAt)
+                ELSE 0 END AS waited
+    FROM prompt
+    WHERE stoped_at IS NOT NULL AND {where}
+"""
+
+_connections = {}
+
+
+def get_connection(db_path):
+    """Return this process's shared connection to ``db_path``, opening it once.
+
+    The connection runs in WAL mode with synchronous=NORMAL so a commit is a
+    single append to the write-ahead log, waits on a busy database instead of
+    failing immediately, and keeps a statement cache for the handlers' queries.
+    """
+    import sqlite3
+
+    key = str(db_path)
+    conn = _connections.get(key)
+    if conn is None:
+        conn = sqlite3.connect(
+            key,
+            timeout=BUSY_TIMEOUT_MS / 1000,
+            cached_statements=128,
+            check_same_thread=False,
+        )
+
+        def configure():
+            # Only takes effect on a new, empty database; older files are
+            # converted by an explicit `ccnotify.py prune`.  Setting it on an
+            # existing file still takes the write lock, so skip it there.
+            if conn.execute("PRAGMA page_count").fetchone()[0] == 0:
+                conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+
+        # The first statement opens the WAL; it can find the database locked
+        # while another hook's closing connection checkpoints it
+        retry_locked(configure)
+        conn.create_function("duration_bucket", 1, duration_bucket, deterministic=True)
+        _connections[key] = conn
+    return conn
+
+
+def retry_locked(operation):
+    """Run ``operation()``, retrying "database is locked" with jittered backoff.
+
+    Gives up and re-raises after LOCK_RETRIES attempts; other errors are
+    raised at once.
+    """
+    import sqlite3
+
+    for attempt in range(LOCK_RETRIES):
+        try:
+            return operation()
+        except sqlite3.OperationalError as e:
+            message = str(e)
+            if attempt == LOCK_RETRIES - 1 or not ("locked" in message or "busy" in message):
+                raise
+            import random
+
+            delay = random.uniform(0, min(LOCK_BACKOFF_MAX, LOCK_BACKOFF * 2 ** attempt))
+            logging.warning(f"Database busy ({message}), retry {attempt + 1} in {delay * 1000:.0f}ms")
+            time.sleep(delay)
+
+
+def event_time(data):
+    """UTC timestamp carried by a replayed event, in SQLite's CURRENT_TIMESTAMP format.
+
+    Live hook payloads have no "timestamp" field, so this returns None and the
+    handlers fall back to CURRENT_TIMESTAMP.
+    """
+    from datetime import datetime, timezone
+
+    value = data.get("timestamp")
+    if value in (None, ""):
+        return None
+    try:
+        if isinstance(value, (int, float)):
+            dt = datetime.fromtimestamp(value, timezone.utc)
+        else:
+            dt = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except (ValueError, OverflowError, OSError):
+        logging.warning(f"Ignoring unparseable event timestamp: {value!r}")
+        return None
+    if dt.tzinfo:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def transcript_prompt_text(entry):
+    """Text the user typed, if this transcript entry is a prompt; otherwise None.
+
+    Tool results, meta/caveat entries, sidechain (subagent) messages and
+    interruption markers are also recorded as "user" entries in Claude
+    transcripts but do not start a new job.
+    """
+    if entry.get("type") != "user" or entry.get("isMeta") or entry.get("isSidechain"):
+        return None
+    message = entry.get("message")
+    content = message.get("content") if isinstance(message, dict) else None
+    if isinstance(content, list):
+        blocks = [block for block in content if isinstance(block, dict)]
+        if any(block.get("type") == "tool_result" for block in blocks):
+            return None
+        content = "\n".join(
+            block.get("text", "") for block in blocks if block.get("type") == "text"
+        )
+    if not isinstance(content, str) or not content.strip():
+        return None
+    if content.startswith(("<local-command-stdout>", "[Request interrupted")):
+        return None
+    return content
+
+
+def duration_bucket(seconds):
+    """Index of the DURATION_BUCKETS bucket holding ``seconds``"""
+    import bisect
+
+    return bisect.bisect_left(DURATION_BUCKETS, seconds or 0)
+
+
+def estimate_percentile(histogram, fraction, low, high):
+    """Approximate a percentile from {bucket: count}, interpolating inside the bucket"""
+    total = sum(histogram.values())
+    if not total:
+        return None
+    rank = fraction * total
+    seen = 0
+    for bucket in sorted(histogram):
+        count = histogram[bucket]
+        if count <= 0:
+            continue
+        if seen + count >= rank:
+            lower = DURATION_BUCKETS[bucket - 1] if bucket > 0 else 0
+            upper = DURATION_BUCKETS[bucket] if bucket < len(DURATION_BUCKETS) else high
+            value = lower + (rank - seen) / count * (upper - lower)
+            return int(min(max(value, low), high))
+        seen += count
+    return high
+
+
+def format_seconds(total_seconds):
+    """Human-readable duration such as 45s, 2m30s or 1h5m"""
+    total_seconds = int(total_seconds)
+    if total_seconds < 60:
+        return f"{total_seconds}s"
+    elif total_seconds < 3600:
+        minutes = total_seconds // 60
+        seconds = total_seconds % 60
+        if seconds > 0:
+            return f"{minutes}m{seconds}s"
+        else:
+            return f"{minutes}m"
+    else:
+        hours = total_seconds // 3600
+        minutes = (total_seconds % 3600) // 60
+        if minutes > 0:
+            return f"{hours}h{minutes}m"
+        else:
+            return f"{hours}h"
+
+
+class EventTimer:
+    """Wall time per phase of one hook event.
+
+    Phases are exclusive: time spent in a phase nested inside another (the
+    environment scan inside notify, say) is only counted for the inner one.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+        self._children = []
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        self._children.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = self._children.pop()
+            self.phases[name] = self.phases.get(name, 0.0) + elapsed - nested
+            if self._children:
+                self._children[-1] += elapsed
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+def timed(timer, name):
+    """timer.phase(name), or a no-op when the event is not being timed"""
+    return timer.phase(name) if timer else nullcontext()
+
+
+def pid_alive(pid):
+    """Check whether a process with this pid still exists"""
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # Exists but belongs to another user
+    except (OSError, ValueError, TypeError):
+        return False
+    return True
+
+
+class ProcessTable:
+    """Point-in-time snapshot of the process table.
+
+    Maps pid -> {'ppid', 'comm', 'tty', 'cmdline'} so that the claude/cwd
+    match and the ancestry walk are dictionary lookups instead of one ps or
+    lsof call per process.  On Linux the snapshot is read from procfs; on
+    other platforms (macOS) it costs a single pair of ps calls, and working
+    directories are resolved with one batched lsof call for all candidates.
+    """
+
+    def __init__(self, procs, proc_root=None):
+        self.procs = procs
+        self.proc_root = proc_root
+        self._cwds = {}
+
+    @classmethod
+    def snapshot(cls, proc_root="/proc"):
+        """Build a snapshot from procfs when available, otherwise from ps"""
+        if os.path.isdir(os.path.join(proc_root, "self")):
+            return cls.from_procfs(proc_root)
+        return cls.from_ps()
+
+    @classmethod
+    def from_procfs(cls, proc_root="/proc"):
+        """Read /proc/<pid>/{stat,cmdline} for every process"""
+        procs = {}
+        for name in os.listdir(proc_root):
+            if not name.isdigit():
+                continue
+            try:
+                with open(os.path.join(proc_root, name, "stat"), "rb") as f:
+                    stat = f.read().decode("utf-8", "replace")
+                with open(os.path.join(proc_root, name, "cmdline"), "rb") as f:
+                    cmdline = f.read().replace(b"\0", b" ").decode("utf-8", "replace")
+            except OSError:
+                continue  # Process exited while we were reading it
+
+            # comm is wrapped in parentheses and may itself contain spaces
+            comm = stat[stat.find("(") + 1 : stat.rfind(")")]
+            fields = stat[stat.rfind(")") + 2 :].split()
+            procs[int(name)] = {
+                "ppid": int(fields[1]),
+                "comm": comm,
+                "tty": cls._tty_name(int(fields[4])),
+                "cmdline": cmdline.strip(),
+            }
+        return cls(procs, proc_root=proc_root)
+
+    @staticmethod
+    def _tty_name(tty_nr):
+        """Translate a procfs tty_nr device number into a ps-style name"""
+        if tty_nr == 0:
+            return "?"
+        major = (tty_nr >> 8) & 0xFFF
+        minor = (tty_nr & 0xFF) | ((tty_nr >> 12) & 0xFFF00)
+        if 136 <= major <= 143:
+            return f"pts/{minor + (major - 136) * 256}"
+        if major == 4:
+            return f"tty{minor}"
+        return f"{major}:{minor}"
+
+    @classmethod
+    def from_ps(cls):
+        """Fallback snapshot built from two ps calls"""
+        import subprocess
+
+        procs = {}
+        # comm is last so that paths with spaces survive the split
+        table = subprocess.run(
+            ["ps", "-axo", "pid=,ppid=,tty=,comm="],
+            capture_output=True,
+            text=True,
+            check=False
+        ).stdout
+        for line in table.splitlines():
+            parts = line.split(None, 3)
+            if len(parts) == 4 and parts[0].isdigit() and parts[1].isdigit():
+                procs[int(parts[0])] = {
+                    "ppid": int(parts[1]),
+                    "tty": parts[2],
+                    "comm": parts[3],
+                    "cmdline": "",
+                }
+
+        args = subprocess.run(
+            ["ps", "-axo", "pid=,args="],
+            capture_output=True,
+            text=True,
+            check=False
+        ).stdout
+        for line in args.splitlines():
+            parts = line.split(None, 1)
+            if len(parts) == 2 and parts[0].isdigit() and int(parts[0]) in procs:
+                procs[int(parts[0])]["cmdline"] = parts[1]
+        return cls(procs)
+
+    def comm(self, pid):
+        return self.procs.get(pid, {}).get("comm", "")
+
+    def tty(self, pid):
+        return self.procs.get(pid, {}).get("tty")
+
+    def find_claude_pids(self):
+        """Pids whose command mentions claude, excluding this process"""
+        own_pid = os.getpid()
+        return [
+            pid
+            for pid, proc in self.procs.items()
+            if pid != own_pid
+            and ("claude" in proc["comm"].lower() or "claude" in proc["cmdline"].lower())
+        ]
+
+    def ancestors(self, pid, limit=5):
+        """Parent pids of ``pid``, nearest first, at most ``limit`` levels"""
+        result = []
+        current = self.procs.get(pid)
+        while current and len(result) < limit:
+            ppid = current["ppid"]
+            if ppid <= 0 or ppid not in self.procs:
+                break
+            result.append(ppid)
+            current = self.procs[ppid]
+        return result
+
+    def cwd(self, pid):
+        """Working directory of ``pid`` or None if it cannot be read"""
+        if pid not in self._cwds:
+            if self.proc_root:
+                try:
+                    self._cwds[pid] = os.readlink(
+                        os.path.join(self.proc_root, str(pid), "cwd")
+                    )
+                except OSError:
+                    self._cwds[pid] = None
+            else:
+                self._resolve_cwds_with_lsof(pid)
+        return self._cwds.get(pid)
+
+    def _resolve_cwds_with_lsof(self, pid):
+        """Resolve cwd for every claude process with a single lsof call"""
+        import subprocess
+
+        pids = [p for p in self.find_claude_pids() if p not in self._cwds]
+        if pid not in pids:
+            pids.append(pid)
+        for p in pids:
+            self._cwds[p] = None
+
+        output = subprocess.run(
+            ["lsof", "-a", "-d", "cwd", "-Fpn", "-p", ",".join(str(p) for p in pids)],
+            capture_output=True,
+            text=True,
+            check=False
+        ).stdout
+        current = None
+        for line in output.splitlines():
+            if line.startswith("p") and line[1:].isdigit():
+                current = int(line[1:])
+            elif line.startswith("n") and current is not None:
+                self._cwds[current] = line[1:].strip()
 
 
 class ClaudePromptTracker:
     def __init__(self):
         """Initialize the prompt tracker with database setup"""
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        self.db_path = os.path.join(script_dir, "ccnotify.db")
+        self.db_path = os.path.join(get_data_dir(), "ccnotify.db")
+        self.config = load_config()
+        self.notifications_enabled = True
+        self.timer = None
+        self._tx_depth = 0
+        self._deferred_notifications = []
         self.setup_logging()
         self.init_database()
 
+    @property
+    def conn(self):
+        """Connection shared by every handler in this process"""
+        return get_connection(self.db_path)
+
+    @contextmanager
+    def transaction(self):
+        """Run writes in one transaction, or in a savepoint inside an outer one.
+
+        The outermost block takes the write lock up front (BEGIN IMMEDIATE),
+        commits on success and rolls back on error.  Nested blocks, such as a
+        handler running inside an ingest batch, use a savepoint so a failing
+        event is undone without losing the rest of the batch.  Notifications
+        raised inside a transaction are sent once the outermost block commits.
+        """
+        conn = self.conn
+        depth = self._tx_depth
+        self._tx_depth += 1
+        try:
+            if depth == 0:
+                with timed(self.timer, "db"):
+                    retry_locked(lambda: conn.execute("BEGIN IMMEDIATE"))
+                    try:
+                        yield conn
+                    except BaseException:
+                        conn.rollback()
+                        self._deferred_notifications.clear()
+                        raise
+                    conn.commit()
+            else:
+                savepoint = f"sp{depth}"
+                conn.execute(f"SAVEPOINT {savepoint}")
+                try:
+                    yield conn
+                except BaseException:
+                    conn.execute(f"ROLLBACK TO {savepoint}")
+                    conn.execute(f"RELEASE {savepoint}")
+                    raise
+                conn.execute(f"RELEASE {savepoint}")
+        finally:
+            self._tx_depth -= 1
+
+        if depth == 0:
+            deferred, self._deferred_notifications = self._deferred_notifications, []
+            for args in deferred:
+                self.notify(*args)
+
     def setup_logging(self):
         """Setup logging to file with daily rotation"""
+        from logging.handlers import TimedRotatingFileHandler
 
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        log_path = os.path.join(script_dir, "ccnotify.log")
+        log_path = os.path.join(get_data_dir(), "ccnotify.log")
 
         # Create a timed rotating file handler
         handler = TimedRotatingFileHandler(
@@ -53,8 +598,14 @@ class ClaudePromptTracker:
         logger.addHandler(handler)
 
     def init_database(self):
-        """Create tables and triggers if they don't exist"""
-        with sqlite3.connect(self.db_path) as conn:
+        """Create tables and triggers if they don't exist.
+
+        A database already at SCHEMA_VERSION is left alone, so a hook only
+        takes the write lock for its own event.
+        """
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION:
+            return
+        with self.transaction() as conn:
             # Create main table
             conn.execute("""
                 CREATE TABLE IF NOT EXISTS prompt (
@@ -85,7 +636,541 @@ class ClaudePromptTracker:
                 END
             """)
 
-            conn.commit()
+            # Indexes for the per-session lookups: latest prompt (Notification),
+            # latest unfinished prompt (Stop) and MAX(seq) in the trigger above
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_prompt_session_created
+                ON prompt (session_id, created_at)
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_prompt_session_open
+                ON prompt (session_id, created_at)
+                WHERE stoped_at IS NULL
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_prompt_session_seq
+                ON prompt (session_id, seq)
+            """)
+
+            # Cache of detect_claude_environment() results per session/cwd
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS env_cache (
+                    session_id TEXT NOT NULL,
+                    cwd TEXT NOT NULL,
+                    type TEXT NOT NULL,
+                    tty TEXT,
+                    pid INTEGER NOT NULL,
+                    detected_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (session_id, cwd)
+                )
+            """)
+
+            # Notifications waiting for the detached delivery worker
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS notification_queue (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    session_id TEXT,
+                    title TEXT NOT NULL,
+                    subtitle TEXT NOT NULL,
+                    cwd TEXT,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    delivered_at DATETIME,
+                    last_error TEXT
+                )
+            """)
+            # Small key/value store for bookkeeping (e.g. last retention run)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                )
+            """)
+
+            # Per-day, per-project rollups.  Finished jobs are added when Stop
+            # records stoped_at; retention only adds the unfinished rows it
+            # deletes.  Durations are in seconds.
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS prompt_daily (
+                    day TEXT NOT NULL,
+                    cwd TEXT NOT NULL,
+                    job_count INTEGER NOT NULL DEFAULT 0,
+                    finished_count INTEGER NOT NULL DEFAULT 0,
+                    total_duration INTEGER NOT NULL DEFAULT 0,
+                    min_duration INTEGER,
+                    max_duration INTEGER,
+                    wait_duration INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (day, cwd)
+                )
+            """)
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(prompt_daily)")]
+            if "wait_duration" not in columns:
+                conn.execute(
+                    "ALTER TABLE prompt_daily ADD COLUMN wait_duration INTEGER NOT NULL DEFAULT 0"
+                )
+
+            # Duration histogram (DURATION_BUCKETS) for median/p95 in stats
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS prompt_daily_hist (
+                    day TEXT NOT NULL,
+                    cwd TEXT NOT NULL,
+                    bucket INTEGER NOT NULL,
+                    count INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (day, cwd, bucket)
+                )
+            """)
+
+            # Per-transcript resume point for backfill
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS backfill_state (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime REAL NOT NULL,
+                    offset INTEGER NOT NULL,
+                    open_prompt_id INTEGER
+                )
+            """)
+
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_notification_queue_pending
+                ON notification_queue (next_attempt_at)
+                WHERE status = 'pending'
+            """)
+
+            # Per-phase wall time of hook events, in microseconds
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS event_timing (
+                    id INTEGER PRIMARY KEY,
+                    recorded_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    session_id TEXT,
+                    event TEXT NOT NULL,
+                    total_us INTEGER NOT NULL,
+                    parse_us INTEGER NOT NULL DEFAULT 0,
+                    validate_us INTEGER NOT NULL DEFAULT 0,
+                    init_us INTEGER NOT NULL DEFAULT 0,
+                    db_us INTEGER NOT NULL DEFAULT 0,
+                    env_us INTEGER NOT NULL DEFAULT 0,
+                    notify_us INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_event_timing_recorded
+                ON event_timing (recorded_at)
+            """)
+
+            # One-time rollup of history recorded before rollups existed
+            if not conn.execute(
+                "SELECT 1 FROM meta WHERE key = 'rollups_built'"
+            ).fetchone():
+                self._rollup_jobs(conn, "1")
+                self._rollup_past_idle_waits(conn)
+                conn.execute(
+                    "INSERT INTO meta (key, value) VALUES ('rollups_built', CURRENT_TIMESTAMP)"
+                )
+
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def handle_event(self, event_name, data, timer=None):
+        """Dispatch a validated hook event to its handler.
+
+        With an EventTimer, the handler's phases are added to it and the
+        result is stored in event_timing.
+        """
+        self.timer = timer
+        try:
+            if event_name == "UserPromptSubmit":
+                self.handle_user_prompt_submit(data)
+            elif event_name == "Stop":
+                self.handle_stop(data)
+            elif event_name == "Notification":
+                self.handle_notification(data)
+        finally:
+            self.timer = None
+            if timer and self.config.get("timing", True):
+                self.record_timing(event_name, data.get("session_id"), timer)
+
+    def record_timing(self, event_name, session_id, timer):
+        """Store one event's phase timings; never fails the hook"""
+        values = [int(timer.phases.get(name, 0.0) * 1e6) for name in TIMING_PHASES]
+        total = int(timer.elapsed() * 1e6)
+        try:
+            with self.transaction() as conn:
+                conn.execute(
+                    f"""
+                    INSERT INTO event_timing (
+                        session_id, event, total_us, {", ".join(f"{name}_us" for name in TIMING_PHASES)}
+                    ) VALUES (?, ?, ?, {", ".join("?" * len(TIMING_PHASES))})
+                """,
+                    [session_id, event_name, total] + values,
+                )
+        except Exception as e:
+            logging.error(f"Error recording event timing: {e}")
+
+    def query_timings(self, hours=24, event=None, limit=10):
+        """Slowest events and per-phase averages/maxima over the last ``hours``.
+
+        Returns (slowest, summary): the ``limit`` slowest events, and one row
+        per event type.  All durations are in milliseconds.
+        """
+        where = "recorded_at >= datetime('now', ?)"
+        params = [f"-{hours} hours"]
+        if event:
+            where += " AND event = ?"
+            params.append(event)
+        columns = ["total"] + list(TIMING_PHASES)
+
+        slowest = []
+        for row in self.conn.execute(
+            f"""
+            SELECT recorded_at, event, session_id, {", ".join(f"{c}_us" for c in columns)}
+            FROM event_timing
+            WHERE {where}
+            ORDER BY total_us DESC
+            LIMIT ?
+        """,
+            params + [limit],
+        ):
+            entry = {"recorded_at": row[0], "event": row[1], "session_id": row[2]}
+            entry.update({c: us / 1000 for c, us in zip(columns, row[3:])})
+            slowest.append(entry)
+
+        summary = []
+        aggregates = ", ".join(f"AVG({c}_us), MAX({c}_us)" for c in columns)
+        for row in self.conn.execute(
+            f"""
+            SELECT event, COUNT(*), {aggregates}
+            FROM event_timing
+            WHERE {where}
+            GROUP BY event
+            ORDER BY event
+        """,
+            params,
+        ):
+            entry = {"event": row[0], "count": row[1]}
+            for i, c in enumerate(columns):
+                entry[c] = {"avg": row[2 + 2 * i] / 1000, "max": row[3 + 2 * i] / 1000}
+            summary.append(entry)
+        return slowest, summary
+
+    def ingest_events(self, lines, batch_size=500):
+        """Apply newline-delimited hook events, committing every ``batch_size``.
+
+        Each line is dispatched on its own ``hook_event_name``.  Lines that do
+        not parse or validate are skipped; an event whose handler fails is
+        rolled back to its savepoint without losing the rest of its batch.
+        Returns (applied, skipped).
+        """
+        applied = skipped = 0
+        batch = []
+
+        def flush():
+            nonlocal applied, skipped
+            with self.transaction():
+                done, failed = self._apply_events(batch)
+            applied += done
+            skipped += failed
+            batch.clear()
+
+        for line_no, line in enumerate(lines, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                data = json.loads(line)
+                event_name = data.get("hook_event_name")
+                validate_input_data(data, event_name)
+            except (ValueError, AttributeError) as e:
+                skipped += 1
+                logging.warning(f"Skipping ingest line {line_no}: {e}")
+                continue
+
+            batch.append((event_name, data))
+            if len(batch) >= batch_size:
+                flush()
+
+        if batch:
+            flush()
+        return applied, skipped
+
+    def _apply_events(self, events):
+        """Handle (event_name, data) pairs, each in its own savepoint.
+
+        Must run inside a transaction.  A failing event is rolled back and
+        logged without affecting the others.  Returns (applied, failed).
+        """
+        applied = failed = 0
+        for event_name, data in events:
+            try:
+                with self.transaction():
+                    self.handle_event(event_name, data)
+                applied += 1
+            except Exception as e:
+                failed += 1
+                logging.error(f"Failed to apply {event_name} event: {e}")
+        return applied, failed
+
+    def fold_journal(self, batch_size=500):
+        """Apply pending journal records to the database, oldest first.
+
+        Only one folder runs at a time (flock on ccnotify.fold.lock).  The
+        journal's id and the offset reached are stored in meta in the same
+        transaction as each batch, so after a crash folding resumes exactly
+        where the last committed batch ended: no record is applied twice
+        or skipped.  Returns the number of records applied.
+        """
+        import fcntl
+
+        lock_path = os.path.join(get_data_dir(), "ccnotify.fold.lock")
+        applied = 0
+        while True:
+            with open(lock_path, "w") as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return applied  # Another folder is running
+                applied += self._fold_pending(batch_size)
+                self._compact_journal()
+
+            # A record appended after our last read but before the unlock
+            # saw the folder busy and did not start another one
+            if not self._journal_pending():
+                return applied
+
+    def _journal_position(self):
+        """(journal_id, offset) of the last folded record, from meta"""
+        rows = dict(self.conn.execute(
+            "SELECT key, value FROM meta WHERE key IN ('journal_id', 'journal_offset')"
+        ).fetchall())
+        return rows.get("journal_id"), int(rows.get("journal_offset") or 0)
+
+    def _journal_pending(self):
+        try:
+            with open(os.path.join(get_data_dir(), JOURNAL_NAME), "rb") as f:
+                journal_id, start = read_journal_header(f)
+                size = os.fstat(f.fileno()).st_size
+        except FileNotFoundError:
+            return False
+        saved_id, offset = self._journal_position()
+        return size > (offset if saved_id == journal_id else start)
+
+    def _fold_pending(self, batch_size):
+        path = os.path.join(get_data_dir(), JOURNAL_NAME)
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            return 0
+
+        applied = 0
+        with f:
+            journal_id, offset = read_journal_header(f)
+            saved_id, saved_offset = self._journal_position()
+            if saved_id == journal_id:
+                offset = saved_offset
+            committed = offset if saved_id == journal_id else None
+            f.seek(offset)
+
+            batch = []
+            while True:
+                line = f.readline()
+                if not line.endswith(b"\n"):
+                    break  # End of file, or a record still being written
+                offset += len(line)
+                record = parse_journal_record(line)
+                if record is None:
+                    logging.error(f"Skipping corrupt journal record at offset {offset - len(line)}")
+                else:
+                    batch.append(record)
+                if len(batch) >= batch_size:
+                    applied += self._fold_batch(batch, journal_id, offset)
+                    batch, committed = [], offset
+            # Also records progress past corrupt lines or onto a new journal
+            if offset != committed:
+                applied += self._fold_batch(batch, journal_id, offset)
+        return applied
+
+    def _fold_batch(self, records, journal_id, offset):
+        """Apply one batch and advance the stored journal position atomically"""
+        now = time.time()
+        applied = 0
+        enabled = self.notifications_enabled
+        with self.transaction() as conn:
+            for event_name, data in records:
+                # Don't pop up notifications for events long past
+                stamp = data.get("timestamp")
+                age = now - stamp if isinstance(stamp, (int, float)) else 0
+                self.notifications_enabled = enabled and age <= JOURNAL_NOTIFY_MAX_AGE
+                applied += self._apply_events([(event_name, data)])[0]
+            self.notifications_enabled = enabled
+            conn.executemany(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                [("journal_id", journal_id), ("journal_offset", str(offset))],
+            )
+        return applied
+
+    def _compact_journal(self):
+        """Remove a fully folded journal once it is large enough to matter.
+
+        Appenders hold a shared flock on the journal lock while they write,
+        so under the exclusive lock nobody is mid-append.  The next append
+        starts a new journal with a new id, which the folder reads from the
+        beginning.
+        """
+        import fcntl
+
+        path = os.path.join(get_data_dir(), JOURNAL_NAME)
+        with open(path + ".lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                with open(path, "rb") as f:
+                    journal_id, _ = read_journal_header(f)
+                    size = os.fstat(f.fileno()).st_size
+            except FileNotFoundError:
+                return
+            saved_id, offset = self._journal_position()
+            if saved_id == journal_id and offset == size and size >= JOURNAL_COMPACT_BYTES:
+                os.unlink(path)
+                logging.info(f"Compacted journal after folding {size} bytes")
+
+    def backfill_transcript(self, path):
+        """Import prompt/stop pairs from one Claude transcript, resuming where the last run stopped.
+
+        The file is streamed line by line from the saved offset, so memory use
+        does not grow with transcript size.  A job starts at each user-typed
+        prompt and ends at the last timestamped entry before the next prompt.
+        The final job in a file may still be running, so the saved offset
+        points at its prompt line and the next run extends its stoped_at
+        instead of inserting it again.  Prompts the hooks already recorded
+        are skipped.  Returns the number of rows inserted.
+        """
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        state = self.conn.execute(
+            "SELECT size, mtime, offset, open_prompt_id FROM backfill_state WHERE path = ?",
+            (path,),
+        ).fetchone()
+        if state and state[0] == st.st_size and state[1] == st.st_mtime:
+            return 0
+
+        # A file that shrank was rewritten; read it again from the start
+        offset, open_prompt_id = (0, None)
+        if state and st.st_size >= state[0]:
+            offset, open_prompt_id = state[2], state[3]
+
+        default_session = os.path.splitext(os.path.basename(path))[0]
+        inserted = 0
+        sessions = set()
+        turn = None
+        position = offset
+
+        with self.transaction() as conn, open(path, "rb") as f:
+            f.seek(offset)
+            for raw in f:
+                line_start = position
+                if not raw.endswith(b"\n"):
+                    break  # Line still being written; pick it up next run
+                position += len(raw)
+                try:
+                    entry = json.loads(raw)
+                except ValueError:
+                    continue
+                if not isinstance(entry, dict):
+                    continue
+
+                prompt = transcript_prompt_text(entry)
+                created_at = event_time(entry) if prompt is not None else None
+                if created_at:
+                    if turn:
+                        inserted += self._store_backfilled_turn(turn, sessions)
+                    turn = {
+                        "offset": line_start,
+                        "session_id": entry.get("sessionId") or default_session,
+                        "cwd": entry.get("cwd") or "",
+                        "prompt": prompt,
+                        "created_at": created_at,
+                        "last_entry": None,
+                        "row_id": open_prompt_id if line_start == offset else None,
+                    }
+                elif turn and entry.get("timestamp"):
+                    # Converted only when the job is stored
+                    turn["last_entry"] = entry
+
+            if turn:
+                inserted += self._store_backfilled_turn(turn, sessions)
+                offset, open_prompt_id = turn["offset"], turn["row_id"]
+            else:
+                offset, open_prompt_id = position, None
+
+            for session_id in sessions:
+                self._renumber_session(session_id)
+
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO backfill_state (path, size, mtime, offset, open_prompt_id)
+                VALUES (?, ?, ?, ?, ?)
+            """,
+                (path, st.st_size, st.st_mtime, offset, open_prompt_id),
+            )
+
+        return inserted
+
+    def _store_backfilled_turn(self, turn, sessions):
+        """Insert or extend one reconstructed job; returns 1 if a row was inserted"""
+        conn = self.conn
+        turn["stoped_at"] = event_time(turn["last_entry"]) if turn["last_entry"] else None
+        if turn["row_id"]:
+            if turn["stoped_at"]:
+                # Swap the job's rollup contribution for its extended duration
+                self._rollup_jobs(conn, "id = ?", (turn["row_id"],), sign=-1)
+                conn.execute(
+                    "UPDATE prompt SET stoped_at = ? WHERE id = ?",
+                    (turn["stoped_at"], turn["row_id"]),
+                )
+                self._rollup_jobs(conn, "id = ?", (turn["row_id"],))
+            return 0
+
+        # Recorded live by the hooks (or by an earlier pass over a copy of
+        # this history, as resumed sessions repeat their predecessor's lines)
+        existing = conn.execute(
+            """
+            SELECT id FROM prompt
+            WHERE session_id = ?
+              AND created_at BETWEEN datetime(?, '-60 seconds') AND datetime(?, '+60 seconds')
+              AND prompt = ?
+            LIMIT 1
+        """,
+            (turn["session_id"], turn["created_at"], turn["created_at"], turn["prompt"]),
+        ).fetchone()
+        if existing:
+            return 0
+
+        cursor = conn.execute(
+            """
+            INSERT INTO prompt (session_id, prompt, cwd, created_at, stoped_at)
+            VALUES (?, ?, ?, ?, ?)
+        """,
+            (turn["session_id"], turn["prompt"], turn["cwd"], turn["created_at"], turn["stoped_at"]),
+        )
+        turn["row_id"] = cursor.lastrowid
+        self._rollup_jobs(conn, "id = ?", (turn["row_id"],))
+        sessions.add(turn["session_id"])
+        return 1
+
+    def _renumber_session(self, session_id):
+        """Reassign seq for a session in created_at order after backfilled inserts"""
+        rows = self.conn.execute(
+            "SELECT id, seq FROM prompt WHERE session_id = ? ORDER BY created_at, id",
+            (session_id,),
+        ).fetchall()
+        self.conn.executemany(
+            "UPDATE prompt SET seq = ? WHERE id = ?",
+            [
+                (seq, record_id)
+                for seq, (record_id, old_seq) in enumerate(rows, 1)
+                if seq != old_seq
+            ],
+        )
 
     def handle_user_prompt_submit(self, data):
         """Handle UserPromptSubmit event - insert new prompt record"""
@@ -93,15 +1178,15 @@ class ClaudePromptTracker:
         prompt = data.get("prompt", "")
         cwd = data.get("cwd", "")
 
-        with sqlite3.connect(self.db_path) as conn:
+        with self.transaction() as conn:
+            self._rollup_idle_wait(conn, session_id, event_time(data))
             conn.execute(
                 """
-                INSERT INTO prompt (session_id, prompt, cwd)
-                VALUES (?, ?, ?)
+                INSERT INTO prompt (session_id, prompt, cwd, created_at)
+                VALUES (?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
             """,
-                (session_id, prompt, cwd),
+                (session_id, prompt, cwd, event_time(data)),
             )
-            conn.commit()
 
         logging.info(f"Recorded prompt for session {session_id}")
 
@@ -109,51 +1194,45 @@ class ClaudePromptTracker:
         """Handle Stop event - update completion time and send notification"""
         session_id = data.get("session_id")
 
-        with sqlite3.connect(self.db_path) as conn:
+        with self.transaction() as conn:
             # Find the latest unfinished record for this session
-            cursor = conn.execute(
+            row = conn.execute(LATEST_OPEN_PROMPT_SQL, (session_id,)).fetchone()
+            if not row:
+                return
+            record_id, created_at, cwd = row
+
+            # Update completion time
+            conn.execute(
                 """
-                SELECT id, created_at, cwd
-                FROM prompt
-                WHERE session_id = ? AND stoped_at IS NULL
-                ORDER BY created_at DESC
-                LIMIT 1
+                UPDATE prompt
+                SET stoped_at = COALESCE(?, CURRENT_TIMESTAMP)
+                WHERE id = ?
             """,
-                (session_id,),
+                (event_time(data), record_id),
             )
 
-            row = cursor.fetchone()
-            if row:
-                record_id, created_at, cwd = row
-
-                # Update completion time
-                conn.execute(
-                    """
-                    UPDATE prompt
-                    SET stoped_at = CURRENT_TIMESTAMP
-                    WHERE id = ?
-                """,
-                    (record_id,),
-                )
-                conn.commit()
+            self._rollup_jobs(conn, "id = ?", (record_id,))
+
+            # Get seq number
+            seq_row = conn.execute(
+                "SELECT seq FROM prompt WHERE id = ?", (record_id,)
+            ).fetchone()
+            seq = seq_row[0] if seq_row else 1
+
+        # Notify outside the transaction so the write lock is not held meanwhile
+        duration = self.calculate_duration_from_db(record_id)
+        self.notify(
+            title=os.path.basename(cwd) if cwd else "Claude Task",
+            subtitle=f"job#{seq} done, duration: {duration}",
+            cwd=cwd,
+            session_id=session_id,
+        )
 
-                # Get seq number and calculate duration
-                cursor = conn.execute(
-                    "SELECT seq FROM prompt WHERE id = ?", (record_id,)
-                )
-                seq_row = cursor.fetchone()
-                seq = seq_row[0] if seq_row else 1
-
-                duration = self.calculate_duration_from_db(record_id)
-                self.send_notification(
-                    title=os.path.basename(cwd) if cwd else "Claude Task",
-                    subtitle=f"job#{seq} done, duration: {duration}",
-                    cwd=cwd,
-                )
+        logging.info(
+            f"Task completed for session {session_id}, job#{seq}, duration: {duration}"
+        )
 
-                logging.info(
-                    f"Task completed for session {session_id}, job#{seq}, duration: {duration}"
-                )
+        self.maybe_schedule_retention()
 
     def handle_notification(self, data):
         """Handle Notification event - check for various notification types and send notifications"""
@@ -189,30 +1268,18 @@ class ClaudePromptTracker:
 
         # Update database for waiting notifications
         if should_update_db:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.transaction() as conn:
                 # Fix: Use subquery instead of ORDER BY/LIMIT in UPDATE
-                conn.execute(
-                    """
-                    UPDATE prompt
-                    SET lastWaitUserAt = CURRENT_TIMESTAMP
-                    WHERE id = (
-                        SELECT id FROM prompt
-                        WHERE session_id = ?
-                        ORDER BY created_at DESC
-                        LIMIT 1
-                    )
-                """,
-                    (session_id,),
-                )
-                conn.commit()
+                conn.execute(MARK_WAITING_SQL, (event_time(data), session_id))
             logging.info(f"Updated lastWaitUserAt for session {session_id}")
 
         # Send notification only if should_notify is True
         if should_notify:
-            self.send_notification(
+            self.notify(
                 title=os.path.basename(cwd) if cwd else "Claude Task",
                 subtitle=subtitle,
                 cwd=cwd,
+                session_id=session_id,
             )
             logging.info(f"Notification sent for session {session_id}: {subtitle}")
         else:
@@ -220,26 +1287,271 @@ class ClaudePromptTracker:
                 f"Notification suppressed for session {session_id}: {subtitle}"
             )
 
-    def calculate_duration_from_db(self, record_id):
-        """Calculate duration for a completed record"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute(
+    def _rollup_jobs(self, conn, where, params=(), sign=1):
+        """Add (sign=1) or remove (sign=-1) finished jobs matching ``where`` in the rollups.
+
+        Counts, totals, waits and the histogram are exact in both directions.
+        min/max are only widened, so removing a job can leave them stale.
+        """
+        metrics = JOB_METRICS_SQL.format(where=where)
+        conn.execute(
+            f"""
+            INSERT INTO prompt_daily (
+                day, cwd, job_count, finished_count,
+                total_duration, min_duration, max_duration, wait_duration
+            )
+            SELECT day, cwd, ? * COUNT(*), ? * COUNT(*),
+                   ? * SUM(duration), MIN(duration), MAX(duration), ? * SUM(waited)
+            FROM ({metrics})
+            GROUP BY day, cwd
+            ON CONFLICT (day, cwd) DO UPDATE SET
+                job_count = job_count + excluded.job_count,
+                finished_count = finished_count + excluded.finished_count,
+                total_duration = total_duration + excluded.total_duration,
+                wait_duration = wait_duration + excluded.wait_duration,
+                min_duration = CASE WHEN excluded.job_count > 0 THEN MIN(
+                    COALESCE(min_duration, excluded.min_duration), excluded.min_duration
+                ) ELSE min_duration END,
+                max_duration = CASE WHEN excluded.job_count > 0 THEN MAX(
+                    COALESCE(max_duration, excluded.max_duration), excluded.max_duration
+                ) ELSE max_duration END
+        """,
+            (sign, sign, sign, sign) + tuple(params),
+        )
+        conn.execute(
+            f"""
+            INSERT INTO prompt_daily_hist (day, cwd, bucket, count)
+            SELECT day, cwd, duration_bucket(duration), ? * COUNT(*)
+            FROM ({metrics})
+            GROUP BY 1, 2, 3
+            ON CONFLICT (day, cwd, bucket) DO UPDATE SET
+                count = count + excluded.count
+        """,
+            (sign,) + tuple(params),
+        )
+
+    def _rollup_idle_wait(self, conn, session_id, now):
+        """Credit the wait between a "waiting for input" notice and this new prompt.
+
+        The notice usually arrives after Stop, so the wait belongs to the
+        session's previous job and ends when the user submits again.
+        """
+        conn.execute(
+            """
+            INSERT INTO prompt_daily (day, cwd, wait_duration)
+            SELECT date(created_at, 'localtime'), COALESCE(cwd, ''),
+                   MAX(0, strftime('%s', COALESCE(?, CURRENT_TIMESTAMP))
+                          - strftime('%s', lastWaitUserAt))
+            FROM prompt
+            WHERE id = (
+                SELECT id FROM prompt
+                WHERE session_id = ?
+                ORDER BY created_at DESC
+                LIMIT 1
+            ) AND lastWaitUserAt > stoped_at
+            ON CONFLICT (day, cwd) DO UPDATE SET
+                wait_duration = wait_duration + excluded.wait_duration
+        """,
+            (now, session_id),
+        )
+
+    def _rollup_past_idle_waits(self, conn):
+        """_rollup_idle_wait() for every job already followed by another prompt"""
+        conn.execute("""
+            INSERT INTO prompt_daily (day, cwd, wait_duration)
+            SELECT day, cwd, SUM(waited) FROM (
+                SELECT date(created_at, 'localtime') AS day, COALESCE(cwd, '') AS cwd,
+                       MAX(0, strftime('%s', next_created_at) - strftime('%s', lastWaitUserAt)) AS waited
+                FROM (
+                    SELECT created_at, cwd, stoped_at, lastWaitUserAt,
+                           LEAD(created_at) OVER (
+                               PARTITION BY session_id ORDER BY created_at
+                           ) AS next_created_at
+                    FROM prompt
+                )
+                WHERE lastWaitUserAt > stoped_at AND next_created_at IS NOT NULL
+            )
+            GROUP BY day, cwd
+            ON CONFLICT (day, cwd) DO UPDATE SET
+                wait_duration = wait_duration + excluded.wait_duration
+        """)
+
+    def query_stats(self, days=30, project=None, daily=False):
+        """Per-project (and optionally per-day) job statistics read from the rollups.
+
+        Returns dicts with jobs, total/median/p95/min/max duration and
+        waiting time in seconds.  Median and p95 are interpolated from the
+        duration histogram, so they are approximate within a bucket.
+        """
+        where = "day >= date('now', 'localtime', ?)"
+        params = [f"-{max(int(days), 1) - 1} days"]
+        if project:
+            where += " AND cwd LIKE ?"
+            params.append(f"%{project}%")
+
+        groups = {}
+        for day, cwd, jobs, total, low, high, waited in self.conn.execute(
+            f"""
+            SELECT day, cwd, finished_count, total_duration,
+                   min_duration, max_duration, wait_duration
+            FROM prompt_daily
+            WHERE {where}
+        """,
+            params,
+        ):
+            key = (day if daily else None, cwd)
+            group = groups.setdefault(key, {
+                "day": day if daily else None, "project": cwd, "jobs": 0,
+                "total": 0, "min": None, "max": None, "waiting": 0, "histogram": {},
+            })
+            group["jobs"] += jobs
+            group["total"] += total
+            group["waiting"] += waited
+            if low is not None:
+                group["min"] = low if group["min"] is None else min(group["min"], low)
+            if high is not None:
+                group["max"] = high if group["max"] is None else max(group["max"], high)
+
+        for day, cwd, bucket, count in self.conn.execute(
+            f"SELECT day, cwd, bucket, count FROM prompt_daily_hist WHERE {where}",
+            params,
+        ):
+            group = groups.get((day if daily else None, cwd))
+            if group:
+                group["histogram"][bucket] = group["histogram"].get(bucket, 0) + count
+
+        results = []
+        for group in groups.values():
+            histogram = group.pop("histogram")
+            low, high = group["min"] or 0, group["max"] or 0
+            group["median"] = estimate_percentile(histogram, 0.5, low, high)
+            group["p95"] = estimate_percentile(histogram, 0.95, low, high)
+            if group["jobs"] or group["waiting"]:
+                results.append(group)
+        results.sort(key=lambda g: (g["day"] or "", -g["total"]), reverse=daily)
+        return results
+
+    def maybe_schedule_retention(self):
+        """Start a background prune at most once a day when retention is enabled"""
+        if int(self.config.get("retention_days") or 0) <= 0:
+            return
+        recent = self.conn.execute("""
+            SELECT 1 FROM meta
+            WHERE key = 'last_retention_at' AND value > datetime('now', '-1 day')
+        """).fetchone()
+        if recent:
+            return
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('last_retention_at', CURRENT_TIMESTAMP)"
+            )
+        spawn_detached("prune", "--auto")
+
+    def apply_retention(self, days, chunk_size=5000, vacuum_pages=2000):
+        """Delete prompt rows older than ``days``, keeping their totals in prompt_daily.
+
+        Finished jobs are already in the rollups, so only unfinished rows add
+        to job_count here.  Rows are processed oldest-id first in chunks, each
+        in its own short transaction, so hooks running meanwhile are only
+        briefly blocked.  Up to ``vacuum_pages`` freed pages are then returned
+        to the filesystem.  Returns the number of rows folded.
+        """
+        cutoff = f"-{int(days)} days"
+        folded = 0
+        while True:
+            with self.transaction() as conn:
+                last_id = conn.execute(
+                    """
+                    SELECT MAX(id) FROM (
+                        SELECT id FROM prompt
+                        WHERE created_at < datetime('now', ?)
+                        ORDER BY id
+                        LIMIT ?
+                    )
+                """,
+                    (cutoff, chunk_size),
+                ).fetchone()[0]
+                if last_id is None:
+                    break
+
+                # Finished jobs were rolled up by Stop; only count the rest
+                conn.execute(
+                    """
+                    INSERT INTO prompt_daily (day, cwd, job_count)
+                    SELECT date(created_at, 'localtime'), COALESCE(cwd, ''), COUNT(*)
+                    FROM prompt
+                    WHERE created_at < datetime('now', ?) AND id <= ?
+                      AND stoped_at IS NULL
+                    GROUP BY 1, 2
+                    ON CONFLICT (day, cwd) DO UPDATE SET
+                        job_count = job_count + excluded.job_count
+                """,
+                    (cutoff, last_id),
+                )
+                cursor = conn.execute(
+                    "DELETE FROM prompt WHERE created_at < datetime('now', ?) AND id <= ?",
+                    (cutoff, last_id),
+                )
+                folded += cursor.rowcount
+
+        with self.transaction() as conn:
+            # Bookkeeping tables that only matter while a session is live
+            conn.execute(
+                "DELETE FROM env_cache WHERE detected_at < datetime('now', '-1 day')"
+            )
+            conn.execute(
                 """
-                SELECT created_at, stoped_at
-                FROM prompt
-                WHERE id = ?
+                DELETE FROM notification_queue
+                WHERE status != 'pending' AND created_at < datetime('now', ?)
             """,
-                (record_id,),
+                (cutoff,),
+            )
+            conn.execute(
+                "DELETE FROM event_timing WHERE recorded_at < datetime('now', ?)", (cutoff,)
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('last_retention_at', CURRENT_TIMESTAMP)"
             )
 
-            row = cursor.fetchone()
-            if row and row[1]:
-                return self.calculate_duration(row[0], row[1])
+        if vacuum_pages:
+            # execute() steps this pragma only once (one page); executescript
+            # runs it to completion
+            self.conn.executescript(f"PRAGMA incremental_vacuum({int(vacuum_pages)});")
+        logging.info(f"Retention folded {folded} prompt rows older than {days} days")
+        return folded
+
+    def enable_incremental_vacuum(self):
+        """Switch a database created before retention existed to auto_vacuum=INCREMENTAL.
+
+        This needs one full VACUUM, so it is only done from `ccnotify.py prune`.
+        """
+        if self.conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return False
+        self.conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self.conn.execute("VACUUM")
+        return True
+
+    def calculate_duration_from_db(self, record_id):
+        """Calculate duration for a completed record"""
+        cursor = self.conn.execute(
+            """
+            SELECT created_at, stoped_at
+            FROM prompt
+            WHERE id = ?
+        """,
+            (record_id,),
+        )
+
+        row = cursor.fetchone()
+        if row and row[1]:
+            return self.calculate_duration(row[0], row[1])
 
         return "Unknown"
 
     def calculate_duration(self, start_time, end_time):
         """Calculate human-readable duration between two timestamps"""
+        from datetime import datetime
+
         try:
             if isinstance(start_time, str):
                 start_dt = datetime.fromisoformat(start_time.replace("Z", "+00:00"))
@@ -252,24 +1564,7 @@ class ClaudePromptTracker:
                 end_dt = datetime.fromisoformat(end_time)
 
             duration = end_dt - start_dt
-            total_seconds = int(duration.total_seconds())
-
-            if total_seconds < 60:
-                return f"{total_seconds}s"
-            elif total_seconds < 3600:
-                minutes = total_seconds // 60
-                seconds = total_seconds % 60
-                if seconds > 0:
-                    return f"{minutes}m{seconds}s"
-                else:
-                    return f"{minutes}m"
-            else:
-                hours = total_seconds // 3600
-                minutes = (total_seconds % 3600) // 60
-                if minutes > 0:
-                    return f"{hours}h{minutes}m"
-                else:
-                    return f"{hours}h"
+            return format_seconds(duration.total_seconds())
         except Exception as e:
             logging.error(f"Error calculating duration: {e}")
             return "Unknown"
@@ -277,150 +1572,400 @@ class ClaudePromptTracker:
     def detect_claude_environment(self, cwd):
         """Detect Claude Code environment without focusing - for click action configuration"""
         try:
-            # Find claude processes with matching cwd
-            ps_output = subprocess.run(
-                ["ps", "aux"],
-                capture_output=True,
-                text=True,
-                check=False
-            ).stdout
-
-            claude_processes = []
-            for line in ps_output.split('\n'):
-                if 'claude' in line.lower() and 'grep' not in line:
-                    parts = line.split()
-                    if len(parts) >= 2:
-                        pid = parts[1]
-                        tty = parts[6] if len(parts) > 6 else None
-                        claude_processes.append({'pid': pid, 'tty': tty, 'line': line})
-
-            if not claude_processes:
+            table = ProcessTable.snapshot()
+
+            claude_pids = table.find_claude_pids()
+            if not claude_pids:
                 logging.debug("No claude processes found for environment detection")
                 return {'type': 'unknown', 'cwd': cwd}
 
-            # Check each process to find one with matching cwd
-            target_process = None
-            for proc in claude_processes:
-                try:
-                    # Get the working directory of the process
-                    proc_cwd = subprocess.run(
-                        ["lsof", "-a", "-p", proc['pid'], "-d", "cwd", "-Fn"],
-                        capture_output=True,
-                        text=True,
-                        check=False
-                    ).stdout
-
-                    # Parse lsof output to get directory
-                    for lsof_line in proc_cwd.split('\n'):
-                        if lsof_line.startswith('n'):
-                            proc_dir = lsof_line[1:].strip()
-                            if cwd and proc_dir == cwd:
-                                target_process = proc
-                                break
-
-                    if target_process:
+            # Find the claude process whose working directory matches
+            target_pid = None
+            if cwd:
+                for pid in claude_pids:
+                    if table.cwd(pid) == cwd:
+                        target_pid = pid
                         break
-                except Exception as e:
-                    logging.debug(f"Error checking process {proc['pid']}: {e}")
-                    continue
 
-            if not target_process:
+            if target_pid is None:
                 logging.debug(f"No claude process found with cwd={cwd}")
                 return {'type': 'unknown', 'cwd': cwd}
 
             # Determine if running in VS Code or Terminal
-            # Walk up the process tree to find VS Code
+            # Walk up the process tree (up to 5 levels) to find VS Code
             is_vscode = False
-            current_pid = target_process['pid']
-
-            # Check up to 5 levels up the process tree
-            for _ in range(5):
-                parent_info = subprocess.run(
-                    ["ps", "-p", current_pid, "-o", "ppid="],
-                    capture_output=True,
-                    text=True,
-                    check=False
-                ).stdout.strip()
-
-                if not parent_info:
-                    break
-
-                parent_pid = parent_info.strip()
-                parent_cmd = subprocess.run(
-                    ["ps", "-p", parent_pid, "-o", "comm="],
-                    capture_output=True,
-                    text=True,
-                    check=False
-                ).stdout.strip()
-
-                if 'code' in parent_cmd.lower() or 'electron' in parent_cmd.lower():
+            for parent_pid in table.ancestors(target_pid, limit=5):
+                parent_cmd = table.comm(parent_pid).lower()
+                if 'code' in parent_cmd or 'electron' in parent_cmd:
                     is_vscode = True
                     logging.debug(f"Found VS Code in process tree at PID {parent_pid}")
                     break
 
-                current_pid = parent_pid
-
+            tty = table.tty(target_pid)
             if is_vscode:
                 logging.info("Detected VS Code environment")
-                return {'type': 'vscode', 'cwd': cwd}
+                return {'type': 'vscode', 'cwd': cwd, 'pid': target_pid}
             else:
-                logging.info(f"Detected Terminal environment, tty={target_process['tty']}")
-                return {'type': 'terminal', 'tty': target_process['tty'], 'cwd': cwd}
+                logging.info(f"Detected Terminal environment, tty={tty}")
+                return {'type': 'terminal', 'tty': tty, 'cwd': cwd, 'pid': target_pid}
 
         except Exception as e:
             logging.error(f"Error detecting Claude environment: {e}")
             return {'type': 'unknown', 'cwd': cwd}
 
+    def resolve_environment(self, cwd, session_id=None):
+        """Return the click-target environment, reusing a cached detection when possible.
 
-    def send_notification(self, title, subtitle, cwd=None):
-        """Send macOS notification using terminal-notifier with click-to-focus action"""
-        from datetime import datetime
+        Cached rows are served while younger than env_cache_ttl and while the
+        claude process they were detected from is still alive; otherwise the
+        process table is scanned again and the result stored.
+        """
+        with timed(self.timer, "env"):
+            return self._resolve_environment(cwd, session_id)
 
-        current_time = datetime.now().strftime("%B %d, %Y at %H:%M")
-
-        try:
-            cmd = [
-                "terminal-notifier",
-                "-sound",
-                "default",
-                "-title",
-                title,
-                "-subtitle",
-                f"{subtitle}\n{current_time}",
-            ]
-
-            # Detect environment and configure click action (don't focus now!)
-            if cwd:
-                env_info = self.detect_claude_environment(cwd)
+    def _resolve_environment(self, cwd, session_id):
+        key = (session_id or "", cwd)
+        ttl = int(self.config.get("env_cache_ttl") or 0)
 
-                if env_info['type'] == 'vscode':
-                    # VS Code: Use -activate to focus VS Code when notification is clicked
-                    cmd.extend(["-activate", "com.microsoft.VSCode"])
-                    logging.info("Configured notification to activate VS Code on click")
+        if ttl > 0:
+            row = self.conn.execute(
+                """
+                SELECT type, tty, pid FROM env_cache
+                WHERE session_id = ? AND cwd = ?
+                  AND detected_at > datetime('now', ?)
+            """,
+                key + (f"-{ttl} seconds",),
+            ).fetchone()
+            if row and pid_alive(row[2]):
+                env_type, tty, pid = row
+                logging.debug(f"Using cached {env_type} environment for {cwd}")
+                env_info = {'type': env_type, 'cwd': cwd, 'pid': pid}
+                if env_type == 'terminal':
+                    env_info['tty'] = tty
+                return env_info
+
+        env_info = self.detect_claude_environment(cwd)
+
+        # Only results tied to a live process are worth caching
+        if ttl > 0 and env_info.get('pid'):
+            with self.transaction() as conn:
+                conn.execute(
+                    """
+                    INSERT OR REPLACE INTO env_cache (session_id, cwd, type, tty, pid)
+                    VALUES (?, ?, ?, ?, ?)
+                """,
+                    key + (env_info['type'], env_info.get('tty'), env_info['pid']),
+                )
+        return env_info
 
-                elif env_info['type'] == 'terminal':
-                    # Terminal: Use helper script to focus the specific tab by TTY
-                    tty = env_info.get('tty', '')
+    def notify(self, title, subtitle, cwd=None, session_id=None):
+        """Send a notification now or queue it, depending on the delivery mode"""
+        if not self.notifications_enabled:
+            return
+        if self._tx_depth:
+            # Wait until the surrounding transaction has committed
+            self._deferred_notifications.append((title, subtitle, cwd, session_id))
+            return
+        with timed(self.timer, "notify"):
+            if self.config.get("delivery") == "queue":
+                self.enqueue_notification(title, subtitle, cwd, session_id)
+            else:
+                self.send_notification(title, subtitle, cwd=cwd, session_id=session_id)
 
-                    # Use the helper script that matches by TTY (most reliable)
-                    script_dir = os.path.dirname(os.path.abspath(__file__))
-                    helper_script = os.path.join(script_dir, "focus-terminal-tab.sh")
+    def enqueue_notification(self, title, subtitle, cwd=None, session_id=None):
+        """Durably queue a notification and make sure a delivery worker runs"""
+        with self.transaction() as conn:
+            conn.execute(
+                """
+                INSERT INTO notification_queue (session_id, title, subtitle, cwd)
+                VALUES (?, ?, ?, ?)
+            """,
+                (session_id, title, subtitle, cwd),
+            )
+        spawn_detached("deliver")
+
+    def drain_notification_queue(self, max_wait=30):
+        """Deliver queued notifications until none are due.
+
+        Only one worker drains at a time (flock on ccnotify.deliver.lock).
+        Failed deliveries are retried with exponential backoff; the worker
+        keeps running while a retry is due within ``max_wait`` seconds.
+        Returns the number of notifications delivered.
+        """
+        import fcntl
+        import time
+
+        lock_path = os.path.join(get_data_dir(), "ccnotify.deliver.lock")
+        delivered = 0
+        while True:
+            with open(lock_path, "w") as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return delivered  # Another worker is draining
+
+                while True:
+                    row, wait = self._next_queued_notification()
+                    if row:
+                        delivered += self._deliver_queued(row)
+                    elif wait is not None and wait <= max_wait:
+                        time.sleep(max(wait, 0.1))
+                    else:
+                        break
 
-                    cmd.extend(["-execute", f"{helper_script} {tty} '{cwd}'"])
-                    logging.info(f"Configured notification to focus Terminal tab (tty={tty}) on click")
+            # Something queued between our last check and the unlock would
+            # otherwise wait for the next hook to spawn a worker
+            row, _ = self._next_queued_notification()
+            if not row:
+                return delivered
+
+    def _next_queued_notification(self):
+        """Return (due row, None) or (None, seconds until the next retry)"""
+        row = self.conn.execute("""
+            SELECT id, session_id, title, subtitle, cwd, created_at, attempts
+            FROM notification_queue
+            WHERE status = 'pending' AND next_attempt_at <= CURRENT_TIMESTAMP
+            ORDER BY id
+            LIMIT 1
+        """).fetchone()
+        if row:
+            return row, None
+        wait = self.conn.execute("""
+            SELECT MIN(strftime('%s', next_attempt_at) - strftime('%s', 'now'))
+            FROM notification_queue
+            WHERE status = 'pending'
+        """).fetchone()[0]
+        return None, wait
+
+    def _deliver_queued(self, row):
+        """Attempt one queued notification and record the outcome"""
+        from datetime import datetime, timezone
+
+        record_id, session_id, title, subtitle, cwd, created_at, attempts = row
+
+        # Show when the event happened, not when the worker got to it
+        sent_at = (
+            datetime.fromisoformat(created_at)
+            .replace(tzinfo=timezone.utc)
+            .astimezone()
+        )
+        attempts += 1
+        max_attempts = int(self.config.get("delivery_max_attempts") or 1)
+        try:
+            self.deliver_notification(title, subtitle, cwd, session_id, sent_at)
+        except Exception as e:
+            # A missing terminal-notifier will not fix itself on retry
+            retry = not isinstance(e, FileNotFoundError) and attempts < max_attempts
+            with self.transaction() as conn:
+                conn.execute(
+                    """
+                    UPDATE notification_queue
+                    SET status = ?, attempts = ?, last_error = ?,
+                        next_attempt_at = datetime('now', ?)
+                    WHERE id = ?
+                """,
+                    (
+                        "pending" if retry else "failed",
+                        attempts,
+                        str(e),
+                        f"+{2 ** attempts} seconds",
+                        record_id,
+                    ),
+                )
+            logging.warning(f"Queued notification {record_id} attempt {attempts} failed: {e}")
+            return 0
 
-                else:
-                    # Unknown environment: Fallback to opening directory in VS Code
-                    cmd.extend(["-execute", f'/usr/local/bin/code "{cwd}"'])
-                    logging.info("Configured notification to open in VS Code (fallback) on click")
+        with self.transaction() as conn:
+            conn.execute(
+                """
+                UPDATE notification_queue
+                SET status = 'delivered', attempts = ?, delivered_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            """,
+                (attempts, record_id),
+            )
+        return 1
 
-            subprocess.run(cmd, check=False, capture_output=True)
-            logging.info(f"Notification sent: {title} - {subtitle}")
+    def send_notification(self, title, subtitle, cwd=None, session_id=None):
+        """Send macOS notification using terminal-notifier with click-to-focus action"""
+        try:
+            self.deliver_notification(title, subtitle, cwd, session_id)
         except FileNotFoundError:
             logging.warning("terminal-notifier not found, notification skipped")
         except Exception as e:
             logging.error(f"Error sending notification: {e}")
 
+    def deliver_notification(self, title, subtitle, cwd=None, session_id=None, sent_at=None):
+        """Run terminal-notifier, raising if it cannot be started or fails"""
+        import subprocess
+        from datetime import datetime
+
+        current_time = (sent_at or datetime.now()).strftime("%B %d, %Y at %H:%M")
+
+        cmd = [
+            "terminal-notifier",
+            "-sound",
+            "default",
+            "-title",
+            title,
+            "-subtitle",
+            f"{subtitle}\n{current_time}",
+        ]
+
+        # Detect environment and configure click action (don't focus now!)
+        if cwd:
+            env_info = self.resolve_environment(cwd, session_id)
+
+            if env_info['type'] == 'vscode':
+                # VS Code: Use -activate to focus VS Code when notification is clicked
+                cmd.extend(["-activate", "com.microsoft.VSCode"])
+                logging.info("Configured notification to activate VS Code on click")
+
+            elif env_info['type'] == 'terminal':
+                # Terminal: Use helper script to focus the specific tab by TTY
+                tty = env_info.get('tty', '')
+
+                # Use the helper script that matches by TTY (most reliable)
+                script_dir = os.path.dirname(os.path.abspath(__file__))
+                helper_script = os.path.join(script_dir, "focus-terminal-tab.sh")
+
+                cmd.extend(["-execute", f"{helper_script} {tty} '{cwd}'"])
+                logging.info(f"Configured notification to focus Terminal tab (tty={tty}) on click")
+
+            else:
+                # Unknown environment: Fallback to opening directory in VS Code
+                cmd.extend(["-execute", f'/usr/local/bin/code "{cwd}"'])
+                logging.info("Configured notification to open in VS Code (fallback) on click")
+
+        result = subprocess.run(cmd, check=False, capture_output=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"terminal-notifier exited with status {result.returncode}")
+        logging.info(f"Notification sent: {title} - {subtitle}")
+
+
+def spawn_detached(*args):
+    """Start ``ccnotify.py <args>`` in its own session without waiting for it"""
+    import subprocess
+
+    try:
+        subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), *args],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+            close_fds=True,
+        )
+    except OSError as e:
+        logging.error(f"Could not start background ccnotify {' '.join(args)}: {e}")
+
+
+def journal_record(event_name, data):
+    """One journal line: crc32 of the payload in hex, a space, the JSON payload"""
+    import zlib
+
+    payload = json.dumps(
+        {"event": event_name, "data": data}, ensure_ascii=False, separators=(",", ":")
+    ).encode("utf-8")
+    return b"%08x %s\n" % (zlib.crc32(payload), payload)
+
+
+def parse_journal_record(line):
+    """(event_name, data) from a journal line, or None if it is torn or corrupt"""
+    import zlib
+
+    try:
+        crc, payload = line.rstrip(b"\n").split(b" ", 1)
+        if int(crc, 16) != zlib.crc32(payload):
+            return None
+        record = json.loads(payload)
+        return record["event"], record["data"]
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def read_journal_header(f):
+    """(journal_id, offset of the first record) of an open journal"""
+    header = f.readline()
+    if not header.startswith(JOURNAL_HEADER) or not header.endswith(b"\n"):
+        raise ValueError(f"{f.name} is not a ccnotify journal")
+    return header[len(JOURNAL_HEADER):].strip().decode("ascii"), len(header)
+
+
+def _open_journal(path):
+    """Open the journal for appending, creating it with a fresh id if needed"""
+    flags = os.O_WRONLY | os.O_APPEND
+    try:
+        return os.open(path, flags)
+    except FileNotFoundError:
+        pass
+    # Write the header to a private file and link it into place, so that
+    # concurrent creators never see a journal without its header
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(JOURNAL_HEADER + os.urandom(8).hex().encode("ascii") + b"\n")
+    try:
+        os.link(temp_path, path)
+    except FileExistsError:
+        pass  # Another hook created it first
+    finally:
+        os.unlink(temp_path)
+    return os.open(path, flags)
+
+
+def append_journal(event_name, data):
+    """Append one event to the journal with a single O_APPEND write.
+
+    The event keeps the time it happened (as ``timestamp``) since it is
+    applied later.  A shared flock on the journal lock keeps compaction
+    from removing the file mid-append.
+    """
+    import fcntl
+
+    data = dict(data)
+    data.setdefault("timestamp", time.time())
+    record = journal_record(event_name, data)
+    path = os.path.join(get_data_dir(), JOURNAL_NAME)
+    with open(path + ".lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_SH)
+        fd = _open_journal(path)
+        try:
+            written = os.write(fd, record)
+        finally:
+            os.close(fd)
+    if written != len(record):
+        raise OSError(f"Short write to {path}: {written} of {len(record)} bytes")
+
+
+def journal_folder_running():
+    """Whether a `ccnotify.py fold` process currently holds the fold lock"""
+    import fcntl
+
+    with open(os.path.join(get_data_dir(), "ccnotify.fold.lock"), "a") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        return False
+
+
+def save_failed_event(data):
+    """Append an event the database refused to FAILED_EVENTS_NAME for a later ingest"""
+    from datetime import datetime, timezone
+
+    path = os.path.join(get_data_dir(), FAILED_EVENTS_NAME)
+    record = dict(data)
+    # Keep the original time so a replay records the event when it happened
+    record.setdefault("timestamp", datetime.now(timezone.utc).isoformat())
+    try:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    except OSError as e:
+        logging.error(f"Could not save failed event: {e}")
+    else:
+        logging.error(f"Saved {data.get('hook_event_name')} event to {path}; replay it with `ccnotify.py ingest`")
+
 
 def validate_input_data(data, expected_event_name):
     """Validate input data matches design specification"""
@@ -453,6 +1998,364 @@ def validate_input_data(data, expected_event_name):
     return True
 
 
+def parse_event(expected_event_name, input_data, timer=None):
+    """Decode and validate the raw JSON payload of a hook event"""
+    with timed(timer, "parse"):
+        data = json.loads(input_data)
+    with timed(timer, "validate"):
+        validate_input_data(data, expected_event_name)
+    return data
+
+
+class CCNotifyDaemon:
+    """Long-running server that keeps one warm tracker behind a Unix socket.
+
+    Each client connection carries a single newline-terminated JSON request
+    ``{"event": ..., "data": <raw stdin>}``.  The payload is parsed and
+    validated before replying, so clients still see bad input, but handling
+    happens on one worker thread in arrival order.  That keeps per-session
+    ordering (UserPromptSubmit before Stop) while clients return immediately.
+    """
+
+    def __init__(self, socket_path=None, tracker=None):
+        self.socket_path = socket_path or os.path.join(get_data_dir(), SOCKET_NAME)
+        self.tracker = tracker or ClaudePromptTracker()
+        self.server = None
+        self.worker = None
+        self.events = None
+
+    def _handle_connection(self, rfile, wfile):
+        """Parse one request, reply, and queue the event for the worker"""
+        line = rfile.readline()
+        if not line.strip():
+            return  # Liveness probe or client gave up
+        timer = EventTimer()
+        try:
+            request = json.loads(line)
+            event_name = request.get("event")
+            if event_name not in VALID_EVENTS:
+                raise ValueError(f"Invalid hook type: {event_name}")
+            data = parse_event(event_name, request.get("data") or "", timer)
+        except json.JSONDecodeError as e:
+            reply = {"ok": False, "error": f"JSON decode error: {e}"}
+        except (ValueError, AttributeError) as e:
+            reply = {"ok": False, "error": f"Validation error: {e}"}
+        else:
+            self.events.put((event_name, data, timer))
+            reply = {"ok": True}
+        try:
+            wfile.write(json.dumps(reply).encode("utf-8") + b"\n")
+        except OSError:
+            pass  # Client already went away; the event is queued regardless
+
+    def _work(self):
+        """Apply queued events one at a time until a None sentinel arrives"""
+        while True:
+            item = self.events.get()
+            if item is None:
+                break
+            event_name, data, timer = item
+            try:
+                self.tracker.handle_event(event_name, data, timer)
+            except Exception as e:
+                import sqlite3
+
+                logging.error(f"Daemon failed to handle {event_name}: {e}")
+                if isinstance(e, sqlite3.Error):
+                    save_failed_event(data)
+
+    def _claim_socket(self):
+        """Remove a stale socket file, refusing to start if a daemon answers"""
+        import socket
+
+        if not os.path.exists(self.socket_path):
+            return
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.socket_path)
+        except OSError:
+            os.unlink(self.socket_path)
+        else:
+            raise RuntimeError(f"ccnotify daemon already running on {self.socket_path}")
+        finally:
+            probe.close()
+
+    def start(self):
+        """Bind the socket and start the worker and accept threads"""
+        import queue
+        import socketserver
+        import threading
+
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                daemon._handle_connection(self.rfile, self.wfile)
+
+        self._claim_socket()
+        self.events = queue.Queue()
+        self.server = socketserver.ThreadingUnixStreamServer(self.socket_path, Handler)
+        self.server.daemon_threads = True
+        os.chmod(self.socket_path, 0o600)
+
+        self.worker = threading.Thread(target=self._work, name="ccnotify-worker")
+        self.worker.start()
+        threading.Thread(
+            target=self.server.serve_forever, name="ccnotify-accept", daemon=True
+        ).start()
+        logging.info(f"ccnotify daemon listening on {self.socket_path}")
+
+    def stop(self):
+        """Stop accepting, drain queued events and remove the socket"""
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+        if self.worker:
+            self.events.put(None)
+            self.worker.join()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        logging.info("ccnotify daemon stopped")
+
+    def serve_forever(self):
+        """Run in the foreground until SIGINT/SIGTERM"""
+        import signal
+        import threading
+
+        stopped = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: stopped.set())
+        signal.signal(signal.SIGINT, lambda *_: stopped.set())
+        self.start()
+        try:
+            while not stopped.wait(1):
+                pass
+        finally:
+            self.stop()
+
+
+def forward_to_daemon(event_name, input_data, socket_path=None, timeout=0.5):
+    """Send a hook event to a running daemon.
+
+    Returns True if the daemon accepted the event and False if no daemon is
+    reachable, in which case the caller should handle it in-process.  Input
+    the daemon rejects raises ValueError carrying the daemon's message.
+    """
+    import socket
+
+    socket_path = socket_path or os.path.join(get_data_dir(), SOCKET_NAME)
+    if not hasattr(socket, "AF_UNIX") or not os.path.exists(socket_path):
+        return False
+
+    request = json.dumps({"event": event_name, "data": input_data})
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(socket_path)
+            sock.sendall(request.encode("utf-8") + b"\n")
+            with sock.makefile("rb") as reply_file:
+                reply = json.loads(reply_file.readline())
+    except (OSError, ValueError):
+        return False
+
+    if not reply.get("ok"):
+        raise ValueError(reply.get("error", "rejected by daemon"))
+    return True
+
+
+def command_serve(argv):
+    """ccnotify.py serve - run the daemon in the foreground"""
+    CCNotifyDaemon().serve_forever()
+
+
+def command_deliver(argv):
+    """ccnotify.py deliver - drain the notification queue (spawned by hooks)"""
+    ClaudePromptTracker().drain_notification_queue()
+
+
+def command_fold(argv):
+    """ccnotify.py fold - apply pending journal records (spawned by hooks)"""
+    ClaudePromptTracker().fold_journal()
+
+
+def command_ingest(argv):
+    """ccnotify.py ingest [FILE] - replay newline-delimited hook events"""
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(
+        prog="ccnotify.py ingest",
+        description="Apply newline-delimited hook events from FILE or stdin in batched transactions.",
+    )
+    parser.add_argument("file", nargs="?", default="-", help="JSONL file, '-' for stdin")
+    parser.add_argument("--no-notify", action="store_true", help="record events without sending notifications")
+    parser.add_argument("--batch-size", type=int, default=500, help="events per transaction")
+    args = parser.parse_args(argv)
+
+    tracker = ClaudePromptTracker()
+    tracker.notifications_enabled = not args.no_notify
+
+    start = time.perf_counter()
+    if args.file == "-":
+        applied, skipped = tracker.ingest_events(sys.stdin, max(args.batch_size, 1))
+    else:
+        with open(args.file, encoding="utf-8") as f:
+            applied, skipped = tracker.ingest_events(f, max(args.batch_size, 1))
+    elapsed = time.perf_counter() - start
+
+    rate = applied / elapsed if elapsed > 0 else 0
+    print(f"ingested {applied} events, skipped {skipped} in {elapsed:.2f}s ({rate:.0f} events/s)")
+
+
+def command_backfill(argv):
+    """ccnotify.py backfill [PATH ...] - import history from Claude transcripts"""
+    import argparse
+    import sqlite3
+
+    parser = argparse.ArgumentParser(
+        prog="ccnotify.py backfill",
+        description="Reconstruct prompt history from Claude transcript JSONL files. "
+        "Safe to re-run: each file resumes from where the previous run stopped.",
+    )
+    parser.add_argument(
+        "paths",
+        nargs="*",
+        default=[os.path.expanduser("~/.claude/projects")],
+        help="transcript files or directories (default: ~/.claude/projects)",
+    )
+    args = parser.parse_args(argv)
+
+    files = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(os.path.join(root, n) for n in names if n.endswith(".jsonl"))
+        elif os.path.isfile(path):
+            files.append(path)
+        else:
+            print(f"skipping missing path: {path}", file=sys.stderr)
+
+    tracker = ClaudePromptTracker()
+    inserted = 0
+    for path in sorted(files, key=os.path.getmtime):
+        try:
+            inserted += tracker.backfill_transcript(path)
+        except (OSError, sqlite3.Error) as e:
+            logging.error(f"Backfill failed for {path}: {e}")
+            print(f"failed: {path}: {e}", file=sys.stderr)
+    print(f"backfilled {inserted} prompts from {len(files)} transcript files")
+
+
+def command_prune(argv):
+    """ccnotify.py prune [--days N] - apply the retention policy now"""
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog="ccnotify.py prune",
+        description="Fold prompt rows older than the retention window into per-day "
+        "aggregates, delete them and reclaim the freed space.",
+    )
+    parser.add_argument("--days", type=int, help="override retention_days from ccnotify.json")
+    # Set when a hook schedules the run; skips the one-off full VACUUM
+    parser.add_argument("--auto", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    tracker = ClaudePromptTracker()
+    days = args.days if args.days is not None else int(tracker.config.get("retention_days") or 0)
+    if days <= 0:
+        print("retention disabled (set retention_days in ccnotify.json or pass --days)")
+        return
+    if not args.auto and tracker.enable_incremental_vacuum():
+        print("converted database to incremental auto-vacuum")
+    folded = tracker.apply_retention(days)
+    print(f"folded {folded} prompt rows older than {days} days into prompt_daily")
+
+
+def command_stats(argv):
+    """ccnotify.py stats - per-project job statistics from the rollups"""
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog="ccnotify.py stats",
+        description="Job count, median/p95 duration and time spent waiting on you, per project.",
+    )
+    parser.add_argument("--days", type=int, default=30, help="window in days, including today (default 30)")
+    parser.add_argument("--project", help="only projects whose path contains this text")
+    parser.add_argument("--daily", action="store_true", help="break results down per day")
+    parser.add_argument("--json", action="store_true", help="print JSON instead of a table")
+    args = parser.parse_args(argv)
+
+    rows = ClaudePromptTracker().query_stats(args.days, args.project, args.daily)
+    if args.json:
+        print(json.dumps(rows, ensure_ascii=False, indent=2))
+        return
+    if not rows:
+        print("no finished jobs in this window")
+        return
+
+    def fmt(value):
+        return "-" if value is None else format_seconds(value)
+
+    header = f"{'project':<28} {'jobs':>5} {'median':>8} {'p95':>8} {'total':>8} {'waiting':>8}"
+    print(f"{'day':<11}{header}" if args.daily else header)
+    for row in rows:
+        name = os.path.basename(row["project"].rstrip("/")) or row["project"] or "-"
+        line = (
+            f"{name[:28]:<28} {row['jobs']:>5} {fmt(row['median']):>8} {fmt(row['p95']):>8} "
+            f"{fmt(row['total']):>8} {fmt(row['waiting']):>8}"
+        )
+        print(f"{row['day']:<11}{line}" if args.daily else line)
+
+
+def command_timings(argv):
+    """ccnotify.py timings - slowest hook events and phases"""
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog="ccnotify.py timings",
+        description="Show the slowest hook events and where their time went.",
+    )
+    parser.add_argument("--hours", type=float, default=24, help="window in hours (default 24)")
+    parser.add_argument("--event", choices=VALID_EVENTS, help="only this event type")
+    parser.add_argument("--limit", type=int, default=10, help="slowest events to list (default 10)")
+    parser.add_argument("--json", action="store_true", help="print JSON instead of tables")
+    args = parser.parse_args(argv)
+
+    slowest, summary = ClaudePromptTracker().query_timings(args.hours, args.event, args.limit)
+    if args.json:
+        print(json.dumps({"slowest": slowest, "summary": summary}, indent=2))
+        return
+    if not summary:
+        print("no timed events in this window")
+        return
+
+    columns = ["total"] + list(TIMING_PHASES)
+    header = "".join(f"{c:>9}" for c in columns)
+    print(f"slowest events, ms (last {args.hours:g}h)")
+    print(f"{'recorded_at':<20} {'event':<17} {'session':<10}{header}")
+    for row in slowest:
+        values = "".join(f"{row[c]:>9.1f}" for c in columns)
+        print(f"{row['recorded_at']:<20} {row['event']:<17} {(row['session_id'] or '-')[:10]:<10}{values}")
+
+    print()
+    print("per event type, avg/max ms")
+    print(f"{'event':<17} {'count':>6}" + "".join(f"{c:>14}" for c in columns))
+    for row in summary:
+        values = "".join(f"{row[c]['avg']:.1f}/{row[c]['max']:.1f}".rjust(14) for c in columns)
+        print(f"{row['event']:<17} {row['count']:>6}{values}")
+
+
+COMMANDS = {
+    "serve": command_serve,
+    "deliver": command_deliver,
+    "fold": command_fold,
+    "ingest": command_ingest,
+    "backfill": command_backfill,
+    "prune": command_prune,
+    "stats": command_stats,
+    "timings": command_timings,
+}
+
+
 def main():
     """Main entry point - read JSON from stdin and process event"""
     try:
@@ -461,12 +2364,16 @@ def main():
             print("ok")
             return
 
+        if sys.argv[1] in COMMANDS:
+            COMMANDS[sys.argv[1]](sys.argv[2:])
+            return
+
         expected_event_name = sys.argv[1]
-        valid_events = ["UserPromptSubmit", "Stop", "Notification"]
+        timer = EventTimer()
 
-        if expected_event_name not in valid_events:
+        if expected_event_name not in VALID_EVENTS:
             logging.error(f"Invalid hook type: {expected_event_name}")
-            logging.error(f"Valid hook types: {', '.join(valid_events)}")
+            logging.error(f"Valid hook types: {', '.join(VALID_EVENTS)}")
             sys.exit(1)
 
         # Read JSON data from stdin
@@ -475,19 +2382,33 @@ def main():
             logging.warning("No input data received")
             return
 
-        data = json.loads(input_data)
+        # Prefer a running daemon; fall back to handling the event here
+        try:
+            if forward_to_daemon(expected_event_name, input_data):
+                return
+        except ValueError as e:
+            logging.error(str(e))
+            sys.exit(1)
 
-        # Validate input data
-        validate_input_data(data, expected_event_name)
+        data = parse_event(expected_event_name, input_data, timer)
+
+        if load_config().get("journal"):
+            append_journal(expected_event_name, data)
+            if not journal_folder_running():
+                spawn_detached("fold")
+            return
 
-        tracker = ClaudePromptTracker()
+        try:
+            with timer.phase("init"):
+                tracker = ClaudePromptTracker()
+            tracker.handle_event(expected_event_name, data, timer)
+        except Exception as e:
+            import sqlite3
 
-        if expected_event_name == "UserPromptSubmit":
-            tracker.handle_user_prompt_submit(data)
-        elif expected_event_name == "Stop":
-            tracker.handle_stop(data)
-        elif expected_event_name == "Notification":
-            tracker.handle_notification(data)
+            # Still locked after every retry: keep the event for replay
+            if isinstance(e, sqlite3.Error):
+                save_failed_event(data)
+            raise
 
     except json.JSONDecodeError as e:
         logging.error(f"JSON decode error: {e}")
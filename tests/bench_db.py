@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for per-event database time
+
+Compares the old storage pattern (a fresh sqlite3.connect() per step in
+rollback-journal mode) with the shared WAL connection used by
+ClaudePromptTracker.  Notifications are stubbed out so only DB work is timed.
+
+Usage:
+    python bench_db.py [events]
+"""
+
+import os
+import sys
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import ccnotify
+
+
+def legacy_init(db_path):
+    """init_database() as every hook used to run it"""
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS prompt (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                prompt TEXT,
+                cwd TEXT,
+                seq INTEGER,
+                stoped_at DATETIME,
+                lastWaitUserAt DATETIME
+            )
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS auto_increment_seq
+            AFTER INSERT ON prompt
+            FOR EACH ROW
+            BEGIN
+                UPDATE prompt
+                SET seq = (
+                    SELECT COALESCE(MAX(seq), 0) + 1
+                    FROM prompt
+                    WHERE session_id = NEW.session_id
+                )
+                WHERE id = NEW.id;
+            END
+        """)
+        conn.commit()
+
+
+def legacy_submit(db_path, session_id, cwd):
+    legacy_init(db_path)
+    with sqlite3.connect(db_path) as conn:
+        conn.execute(
+            "INSERT INTO prompt (session_id, prompt, cwd) VALUES (?, ?, ?)",
+            (session_id, "benchmark prompt", cwd),
+        )
+        conn.commit()
+
+
+def legacy_stop(db_path, session_id):
+    legacy_init(db_path)
+    with sqlite3.connect(db_path) as conn:
+        row = conn.execute(
+            """
+            SELECT id, created_at, cwd FROM prompt
+            WHERE session_id = ? AND stoped_at IS NULL
+            ORDER BY created_at DESC LIMIT 1
+        """,
+            (session_id,),
+        ).fetchone()
+        if row:
+            conn.execute(
+                "UPDATE prompt SET stoped_at = CURRENT_TIMESTAMP WHERE id = ?", (row[0],)
+            )
+            conn.commit()
+            conn.execute("SELECT seq FROM prompt WHERE id = ?", (row[0],)).fetchone()
+            with sqlite3.connect(db_path) as conn2:
+                conn2.execute(
+                    "SELECT created_at, stoped_at FROM prompt WHERE id = ?", (row[0],)
+                ).fetchone()
+
+
+def run_legacy(events):
+    db_path = os.path.join(tempfile.mkdtemp(), "legacy.db")
+    timings = []
+    for i in range(events):
+        session_id = f"session_{i % 20}"
+        start = time.perf_counter()
+        legacy_submit(db_path, session_id, f"/Users/dev/projects/p{i % 5}")
+        legacy_stop(db_path, session_id)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def run_tracker(events):
+    os.environ["CCNOTIFY_HOME"] = tempfile.mkdtemp()
+    timings = []
+    with patch.object(ccnotify.ClaudePromptTracker, "setup_logging"), patch.object(
+        ccnotify.ClaudePromptTracker, "notify"
+    ):
+        for i in range(events):
+            session_id = f"session_{i % 20}"
+            start = time.perf_counter()
+            # One tracker per event, as a hook process builds it
+            tracker = ccnotify.ClaudePromptTracker()
+            tracker.handle_user_prompt_submit(
+                {"session_id": session_id, "prompt": "benchmark prompt",
+                 "cwd": f"/Users/dev/projects/p{i % 5}"}
+            )
+            tracker.handle_stop({"session_id": session_id})
+            timings.append(time.perf_counter() - start)
+    return timings
+
+
+def summarize(name, timings):
+    timings = sorted(timings)
+    p50 = timings[len(timings) // 2] * 1000
+    p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))] * 1000
+    mean = sum(timings) / len(timings) * 1000
+    print(f"{name:<28} mean {mean:7.3f} ms   p50 {p50:7.3f} ms   p99 {p99:7.3f} ms")
+    return mean
+
+
+def main():
+    events = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    print(f"Submit+Stop pairs: {events}")
+    before = summarize("per-call connect (before)", run_legacy(events))
+    after = summarize("shared WAL connection", run_tracker(events))
+    print(f"speedup: {before / after:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+End-to-end hook latency benchmark
+
+Replays the tests/test_data/scenario_*.json flows through ccnotify.main(),
+exactly as the hook commands invoke it, with terminal-notifier, ps and lsof
+replaced by stub scripts on PATH.  Reports p50/p99 wall time per event type
+and per phase:
+
+    startup      ClaudePromptTracker() - logging and database setup
+    parse        parse_event()
+    handler      handle_event(), including notify
+    notify       deliver_notification(), including environment
+    environment  resolve_environment() - process table scan or cache hit
+
+Phases only count events that reach them, so n differs per phase.
+
+With --spawn every event instead runs as its own `python ccnotify.py <Event>`
+process, which is what a hook really costs, but only the total is timed.
+Process detection always goes through the ps/lsof stubs in-process; spawned
+runs on Linux read the real /proc instead.
+
+Baselines are machine-specific JSON files.  --save writes one; --compare
+exits with status 1 when a p50 grew by more than --threshold over it.
+
+Usage:
+    python bench_hooks.py [--rounds N] [--spawn] [--save FILE] [--compare FILE]
+"""
+
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+from unittest.mock import patch
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import ccnotify
+
+SCRIPT = Path(__file__).parent.parent / "ccnotify.py"
+SCENARIOS = sorted((Path(__file__).parent / "test_data").glob("scenario_*.json"))
+DEFAULT_BASELINE = Path(__file__).parent / "bench_hooks_baseline.json"
+
+# Differences below this many milliseconds are treated as noise
+NOISE_FLOOR_MS = 0.2
+
+
+def load_scenarios():
+    return [(path.stem, json.loads(path.read_text(encoding="utf-8"))) for path in SCENARIOS]
+
+
+def write_stub(directory, name, body):
+    path = os.path.join(directory, name)
+    with open(path, "w") as f:
+        f.write("#!/bin/sh\n" + body)
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+
+
+def make_stubs(scenarios):
+    """Stub terminal-notifier, ps and lsof describing one claude per project"""
+    directory = tempfile.mkdtemp(prefix="ccnotify-stubs-")
+    cwds = sorted({event["cwd"] for _, events in scenarios for event in events})
+
+    table = ["  100     1 ??       /System/Applications/Utilities/Terminal.app"]
+    args = ["  100 /System/Applications/Utilities/Terminal.app"]
+    lsof = []
+    for i, cwd in enumerate(cwds):
+        shell, claude, tty = 1000 + 2 * i, 1001 + 2 * i, f"ttys{i:03d}"
+        table += [f"{shell:>5}   100 {tty:<8} -zsh", f"{claude:>5} {shell:>5} {tty:<8} node"]
+        args += [f"{shell:>5} -zsh", f"{claude:>5} node /usr/local/bin/claude"]
+        lsof += [f"p{claude}", "fcwd", f"n{cwd}"]
+
+    for name, lines in [("ps.table", table), ("ps.args", args), ("lsof.out", lsof)]:
+        with open(os.path.join(directory, name), "w") as f:
+            f.write("\n".join(lines) + "\n")
+    write_stub(directory, "terminal-notifier", "exit 0\n")
+    write_stub(
+        directory, "ps",
+        f'case "$*" in *args=*) cat "{directory}/ps.args" ;; *) cat "{directory}/ps.table" ;; esac\n',
+    )
+    write_stub(directory, "lsof", f'cat "{directory}/lsof.out"\n')
+    return directory
+
+
+def rounds_of(scenarios, rounds):
+    """(round, event) pairs, with session ids made unique per round"""
+    for round_no in range(rounds):
+        for _, events in scenarios:
+            for event in events:
+                event = dict(event, session_id=f"{event['session_id']}_r{round_no}")
+                yield round_no, event
+
+
+class PhaseTimer:
+    """Accumulates wall time of wrapped callables into the current event"""
+
+    def __init__(self):
+        self.current = None
+
+    def wrap(self, phase, func):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                if self.current is not None:
+                    self.current[phase] += time.perf_counter() - start
+
+        return timed
+
+
+def run_in_process(scenarios, rounds):
+    samples = defaultdict(lambda: defaultdict(list))
+    timer = PhaseTimer()
+    tracker_cls = ccnotify.ClaudePromptTracker
+    root = logging.getLogger()
+
+    with patch.object(ccnotify.ProcessTable, "snapshot", classmethod(lambda cls, proc_root=None: cls.from_ps())), \
+         patch.object(tracker_cls, "__init__", timer.wrap("startup", tracker_cls.__init__)), \
+         patch.object(tracker_cls, "handle_event", timer.wrap("handler", tracker_cls.handle_event)), \
+         patch.object(tracker_cls, "resolve_environment", timer.wrap("environment", tracker_cls.resolve_environment)), \
+         patch.object(tracker_cls, "deliver_notification", timer.wrap("notify", tracker_cls.deliver_notification)), \
+         patch.object(ccnotify, "parse_event", timer.wrap("parse", ccnotify.parse_event)):
+        for _, event in rounds_of(scenarios, rounds):
+            event_name = event["hook_event_name"]
+            handlers = list(root.handlers)
+            timer.current = defaultdict(float)
+            with patch.object(sys, "argv", ["ccnotify.py", event_name]), \
+                 patch.object(sys, "stdin", io.StringIO(json.dumps(event))):
+                start = time.perf_counter()
+                ccnotify.main()
+                timer.current["total"] = time.perf_counter() - start
+            for phase, seconds in timer.current.items():
+                samples[event_name][phase].append(seconds)
+            timer.current = None
+            # A hook process exits here; drop the handler it configured
+            for handler in root.handlers[len(handlers):]:
+                root.removeHandler(handler)
+                handler.close()
+    return samples
+
+
+def run_spawned(scenarios, rounds, env):
+    samples = defaultdict(lambda: defaultdict(list))
+    for _, event in rounds_of(scenarios, rounds):
+        event_name = event["hook_event_name"]
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, str(SCRIPT), event_name],
+            input=json.dumps(event), text=True, capture_output=True, env=env, check=True,
+        )
+        samples[event_name]["total"].append(time.perf_counter() - start)
+    return samples
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def summarize(samples):
+    """{event: {phase: {"p50": ms, "p99": ms, "n": count}}}"""
+    return {
+        event_name: {
+            phase: {
+                "p50": round(percentile(values, 0.5) * 1000, 3),
+                "p99": round(percentile(values, 0.99) * 1000, 3),
+                "n": len(values),
+            }
+            for phase, values in sorted(phases.items())
+        }
+        for event_name, phases in sorted(samples.items())
+    }
+
+
+def print_summary(summary):
+    print(f"{'event':<18} {'phase':<12} {'p50 ms':>9} {'p99 ms':>9} {'n':>6}")
+    for event_name, phases in summary.items():
+        for phase, stats in phases.items():
+            print(f"{event_name:<18} {phase:<12} {stats['p50']:>9.3f} {stats['p99']:>9.3f} {stats['n']:>6}")
+
+
+def find_regressions(baseline, summary, threshold):
+    """p50s that grew by more than ``threshold`` (a fraction) and the noise floor"""
+    regressions = []
+    for event_name, phases in summary.items():
+        for phase, stats in phases.items():
+            before = baseline.get(event_name, {}).get(phase)
+            if not before:
+                continue
+            limit = max(before["p50"] * (1 + threshold), before["p50"] + NOISE_FLOOR_MS)
+            if stats["p50"] > limit:
+                regressions.append((event_name, phase, before["p50"], stats["p50"]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--rounds", type=int, default=50, help="times each scenario is replayed")
+    parser.add_argument("--spawn", action="store_true", help="run every event as its own process")
+    parser.add_argument("--save", nargs="?", const=str(DEFAULT_BASELINE), help="write results as a baseline")
+    parser.add_argument("--compare", nargs="?", const=str(DEFAULT_BASELINE), help="fail on regression against a baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed p50 growth (default 0.25 = 25%%)")
+    args = parser.parse_args()
+
+    scenarios = load_scenarios()
+    stubs = make_stubs(scenarios)
+    home = tempfile.mkdtemp(prefix="ccnotify-bench-")
+    env = dict(os.environ, CCNOTIFY_HOME=home, PATH=stubs + os.pathsep + os.environ.get("PATH", ""))
+    mode = "spawn" if args.spawn else "in_process"
+
+    try:
+        if args.spawn:
+            samples = run_spawned(scenarios, args.rounds, env)
+        else:
+            with patch.dict(os.environ, env):
+                samples = run_in_process(scenarios, args.rounds)
+    finally:
+        shutil.rmtree(stubs, ignore_errors=True)
+        shutil.rmtree(home, ignore_errors=True)
+    summary = summarize(samples)
+    print(f"mode: {mode}, rounds: {args.rounds}, scenarios: {len(scenarios)}")
+    print_summary(summary)
+
+    status = 0
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f).get(mode, {})
+        regressions = find_regressions(baseline, summary, args.threshold)
+        for event_name, phase, before, after in regressions:
+            print(f"REGRESSION {event_name}/{phase}: p50 {before:.3f} ms -> {after:.3f} ms")
+        if not baseline:
+            print(f"no {mode} baseline in {args.compare}")
+        elif not regressions:
+            print(f"no regressions beyond {args.threshold:.0%} against {args.compare}")
+        status = 1 if regressions else 0
+
+    if args.save:
+        data = {}
+        if os.path.exists(args.save):
+            with open(args.save) as f:
+                data = json.load(f)
+        data[mode] = summary
+        data.setdefault("machine", {}).update(
+            {mode: {"python": platform.python_version(), "platform": platform.platform()}}
+        )
+        with open(args.save, "w") as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"saved {mode} baseline to {args.save}")
+
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
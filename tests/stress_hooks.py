@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Multi-process stress test for concurrent hooks
+
+Starts one process per synthetic Claude session, releases them together,
+and has each run --jobs prompt cycles (UserPromptSubmit, an occasional
+"waiting for your input" Notification, Stop) as fast as it can against one
+shared database.  Every event goes through ccnotify.main() with a fresh
+connection, as a hook process would; with --spawn each event really is a
+new `python ccnotify.py <Event>` process.  terminal-notifier is stubbed.
+
+Afterwards the database is checked: every submitted prompt must exist and
+be stopped, every waiting notice recorded, and nothing left in the
+failed-events file.  The run fails (exit 1) on any lost event or when the
+p99 event latency exceeds --max-p99-ms.
+
+Usage:
+    python stress_hooks.py [--sessions 24] [--jobs 40] [--spawn] [--max-p99-ms 2000]
+"""
+
+import argparse
+import io
+import json
+import logging
+import multiprocessing
+import os
+import random
+import shutil
+import sqlite3
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+from unittest.mock import patch
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import ccnotify
+
+SCRIPT = Path(__file__).parent.parent / "ccnotify.py"
+
+
+def session_events(session_no, jobs, seed):
+    """The hook events of one synthetic session, in order"""
+    rng = random.Random(seed + session_no)
+    session_id = f"stress_{session_no:03d}"
+    cwd = f"/Users/dev/projects/p{session_no % 7}"
+    for job in range(jobs):
+        yield {"session_id": session_id, "prompt": f"job {job}", "cwd": cwd,
+               "hook_event_name": "UserPromptSubmit"}
+        if rng.random() < 0.3:
+            yield {"session_id": session_id, "cwd": cwd, "hook_event_name": "Notification",
+                   "message": "Claude is waiting for your input"}
+        yield {"session_id": session_id, "cwd": cwd, "hook_event_name": "Stop"}
+
+
+def run_event_in_process(event):
+    """One hook invocation: ccnotify.main() with its own connection and log handler"""
+    root = logging.getLogger()
+    handlers = list(root.handlers)
+    with patch.object(sys, "argv", ["ccnotify.py", event["hook_event_name"]]), \
+         patch.object(sys, "stdin", io.StringIO(json.dumps(event))):
+        try:
+            ccnotify.main()
+            ok = True
+        except SystemExit as e:
+            ok = not e.code
+    for conn in ccnotify._connections.values():
+        conn.close()
+    ccnotify._connections.clear()
+    for handler in root.handlers[len(handlers):]:
+        root.removeHandler(handler)
+        handler.close()
+    return ok
+
+
+def run_event_spawned(event):
+    result = subprocess.run(
+        [sys.executable, str(SCRIPT), event["hook_event_name"]],
+        input=json.dumps(event), text=True, capture_output=True,
+    )
+    return result.returncode == 0
+
+
+def worker(session_no, args, barrier, results):
+    run_event = run_event_spawned if args.spawn else run_event_in_process
+    samples = []
+    barrier.wait()
+    for event in session_events(session_no, args.jobs, args.seed):
+        start = time.perf_counter()
+        ok = run_event(event)
+        samples.append((event["hook_event_name"], time.perf_counter() - start, ok))
+    results.put(samples)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+def verify(home, args):
+    """Events the database should hold but does not"""
+    expected_prompts = defaultdict(int)
+    expected_waits = defaultdict(int)
+    for session_no in range(args.sessions):
+        for event in session_events(session_no, args.jobs, args.seed):
+            if event["hook_event_name"] == "UserPromptSubmit":
+                expected_prompts[event["session_id"]] += 1
+            elif event["hook_event_name"] == "Notification":
+                expected_waits[event["session_id"]] += 1
+
+    problems = []
+    with sqlite3.connect(os.path.join(home, "ccnotify.db")) as conn:
+        rows = conn.execute("""
+            SELECT session_id, COUNT(*), COUNT(stoped_at), COUNT(lastWaitUserAt),
+                   COUNT(DISTINCT seq), MAX(seq)
+            FROM prompt GROUP BY session_id
+        """).fetchall()
+    found = {row[0]: row[1:] for row in rows}
+    for session_id, prompts in sorted(expected_prompts.items()):
+        count, stopped, waited, distinct_seq, max_seq = found.get(session_id, (0, 0, 0, 0, 0))
+        if count != prompts:
+            problems.append(f"{session_id}: {count}/{prompts} prompts")
+        if stopped != prompts:
+            problems.append(f"{session_id}: {stopped}/{prompts} stopped")
+        # Several notices can land on the same job, so only check for at least one per job that got any
+        if expected_waits[session_id] and not waited:
+            problems.append(f"{session_id}: waiting notices not recorded")
+        if count and (distinct_seq != count or max_seq != count):
+            problems.append(f"{session_id}: seq not 1..{count}")
+
+    failed = os.path.join(home, ccnotify.FAILED_EVENTS_NAME)
+    if os.path.exists(failed):
+        with open(failed) as f:
+            problems.append(f"{sum(1 for _ in f)} events in {ccnotify.FAILED_EVENTS_NAME}")
+    return problems
+
+
+def make_notifier_stub():
+    directory = tempfile.mkdtemp(prefix="ccnotify-stubs-")
+    path = os.path.join(directory, "terminal-notifier")
+    with open(path, "w") as f:
+        f.write("#!/bin/sh\nexit 0\n")
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+    return directory
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--sessions", type=int, default=24, help="concurrent sessions (processes)")
+    parser.add_argument("--jobs", type=int, default=40, help="prompt cycles per session")
+    parser.add_argument("--spawn", action="store_true", help="run every event as its own process")
+    parser.add_argument("--max-p99-ms", type=float, default=2000, help="fail above this p99 latency")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--keep", action="store_true", help="keep the database and log for inspection")
+    args = parser.parse_args()
+
+    home = tempfile.mkdtemp(prefix="ccnotify-stress-")
+    stubs = make_notifier_stub()
+    os.environ["CCNOTIFY_HOME"] = home
+    os.environ["PATH"] = stubs + os.pathsep + os.environ.get("PATH", "")
+
+    ctx = multiprocessing.get_context("fork" if hasattr(os, "fork") else "spawn")
+    barrier = ctx.Barrier(args.sessions)
+    results = ctx.Queue()
+    workers = [ctx.Process(target=worker, args=(n, args, barrier, results)) for n in range(args.sessions)]
+    try:
+        start = time.perf_counter()
+        for process in workers:
+            process.start()
+        samples = [sample for _ in workers for sample in results.get()]
+        for process in workers:
+            process.join()
+        wall = time.perf_counter() - start
+
+        by_event = defaultdict(list)
+        for event_name, seconds, _ in samples:
+            by_event[event_name].append(seconds)
+            by_event["all"].append(seconds)
+        errors = sum(1 for _, _, ok in samples if not ok)
+
+        print(f"{args.sessions} sessions x {args.jobs} jobs: {len(samples)} events in {wall:.1f}s "
+              f"({len(samples) / wall:.0f}/s, {'spawned' if args.spawn else 'in-process'})")
+        print(f"{'event':<18} {'n':>6} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+        for event_name, values in sorted(by_event.items()):
+            print(f"{event_name:<18} {len(values):>6} {percentile(values, 0.5) * 1000:>9.1f} "
+                  f"{percentile(values, 0.99) * 1000:>9.1f} {max(values) * 1000:>9.1f}")
+
+        problems = verify(home, args)
+        if errors:
+            problems.append(f"{errors} hook invocations exited with an error")
+        p99 = percentile(by_event["all"], 0.99) * 1000
+        if p99 > args.max_p99_ms:
+            problems.append(f"p99 {p99:.1f}ms exceeds {args.max_p99_ms:.0f}ms")
+    finally:
+        shutil.rmtree(stubs, ignore_errors=True)
+        if args.keep:
+            print(f"kept {home}")
+        else:
+            shutil.rmtree(home, ignore_errors=True)
+
+    for problem in problems:
+        print(f"FAIL {problem}")
+    if not problems:
+        print("no lost events")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
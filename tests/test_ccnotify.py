@@ -0,0 +1,870 @@
+#!/usr/bin/env python3
+"""
+Test suite for ccnotify.py
+"""
+
+import io
+import os
+import sys
+import json
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from datetime import datetime, timezone
+from pathlib import Path
+from unittest.mock import patch, MagicMock
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import ccnotify
+from ccnotify import ClaudePromptTracker, CCNotifyDaemon, ProcessTable, forward_to_daemon
+
+
+class TrackerTestCase(unittest.TestCase):
+    """Base class running each test against a fresh CCNOTIFY_HOME"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.env = patch.dict(os.environ, {"CCNOTIFY_HOME": self.temp_dir})
+        self.env.start()
+        self.db_path = os.path.join(self.temp_dir, "ccnotify.db")
+
+    def tearDown(self):
+        self.env.stop()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def submit(self, tracker, session_id, prompt="测试任务", cwd="/Users/dev/projects/app"):
+        tracker.handle_event(
+            "UserPromptSubmit",
+            {
+                "session_id": session_id,
+                "prompt": prompt,
+                "cwd": cwd,
+                "hook_event_name": "UserPromptSubmit",
+            },
+        )
+
+    def fetch_rows(self, sql, params=()):
+        with sqlite3.connect(self.db_path) as conn:
+            return conn.execute(sql, params).fetchall()
+
+
+class TestStorage(TrackerTestCase):
+    def test_handlers_share_one_tuned_connection(self):
+        tracker = ClaudePromptTracker()
+        other = ClaudePromptTracker()
+        self.assertIs(tracker.conn, other.conn)
+        self.assertEqual(tracker.conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+        self.assertEqual(tracker.conn.execute("PRAGMA synchronous").fetchone()[0], 1)
+        self.assertEqual(tracker.conn.execute("PRAGMA busy_timeout").fetchone()[0], ccnotify.BUSY_TIMEOUT_MS)
+
+        with patch("sqlite3.connect") as connect, patch.object(tracker, "notify"):
+            self.submit(tracker, "s1")
+            tracker.handle_event("Stop", {"session_id": "s1", "hook_event_name": "Stop"})
+        connect.assert_not_called()
+        self.assertEqual(self.fetch_rows("SELECT seq FROM prompt WHERE stoped_at IS NOT NULL"), [(1,)])
+
+
+class TestLockContention(TrackerTestCase):
+    def hold_write_lock(self, seconds=None):
+        """Take the write lock from another connection, optionally releasing it later"""
+        import threading
+
+        other = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False)
+        other.execute("BEGIN IMMEDIATE")
+        if seconds is not None:
+            threading.Timer(seconds, lambda: (other.execute("COMMIT"), other.close())).start()
+        return other
+
+    def fresh_tracker(self):
+        """A tracker with its own connection, as a new hook process would have"""
+        ccnotify._connections.pop(self.db_path, None)
+        return ClaudePromptTracker()
+
+    def test_write_retries_until_lock_is_released(self):
+        ClaudePromptTracker()
+        with patch.object(ccnotify, "BUSY_TIMEOUT_MS", 20), patch.object(ccnotify, "LOCK_BACKOFF", 0.05):
+            tracker = self.fresh_tracker()
+            self.hold_write_lock(0.2)
+            with self.assertLogs(level="WARNING") as logs:
+                self.submit(tracker, "s1")
+        self.assertTrue(any("Database busy" in line for line in logs.output))
+        self.assertEqual(self.fetch_rows("SELECT session_id FROM prompt"), [("s1",)])
+
+    def test_current_schema_skips_the_write_lock(self):
+        ClaudePromptTracker()
+        other = self.hold_write_lock()
+        try:
+            with patch.object(ccnotify, "BUSY_TIMEOUT_MS", 20), patch.object(ccnotify, "LOCK_RETRIES", 1):
+                self.fresh_tracker()
+        finally:
+            other.rollback()
+            other.close()
+
+    def test_event_is_saved_for_replay_when_lock_persists(self):
+        ClaudePromptTracker()
+        ccnotify._connections.pop(self.db_path, None)
+        other = self.hold_write_lock()
+        event = {"session_id": "s1", "prompt": "p", "cwd": "/p", "hook_event_name": "UserPromptSubmit"}
+        try:
+            with patch.object(ccnotify, "BUSY_TIMEOUT_MS", 10), patch.object(ccnotify, "LOCK_RETRIES", 2), \
+                 patch.object(sys, "argv", ["ccnotify.py", "UserPromptSubmit"]), \
+                 patch.object(sys, "stdin", io.StringIO(json.dumps(event))):
+                with self.assertRaises(SystemExit):
+                    ccnotify.main()
+        finally:
+            other.rollback()
+            other.close()
+
+        with open(os.path.join(self.temp_dir, ccnotify.FAILED_EVENTS_NAME)) as f:
+            saved = f.readlines()
+        self.assertEqual(len(saved), 1)
+        self.assertIn("timestamp", json.loads(saved[0]))
+        tracker = ClaudePromptTracker()
+        self.assertEqual(tracker.ingest_events(saved), (1, 0))
+        self.assertEqual(self.fetch_rows("SELECT session_id FROM prompt"), [("s1",)])
+
+
+class TestJournal(TrackerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.journal = os.path.join(self.temp_dir, ccnotify.JOURNAL_NAME)
+
+    def events(self, session_id="s1", jobs=3):
+        for job in range(jobs):
+            yield "UserPromptSubmit", {"session_id": session_id, "prompt": f"job {job}", "cwd": "/p",
+                                       "hook_event_name": "UserPromptSubmit"}
+            yield "Stop", {"session_id": session_id, "hook_event_name": "Stop"}
+
+    def tracker(self):
+        tracker = ClaudePromptTracker()
+        tracker.notifications_enabled = False
+        return tracker
+
+    def test_hook_appends_and_leaves_folding_to_background(self):
+        with open(os.path.join(self.temp_dir, ccnotify.CONFIG_NAME), "w") as f:
+            json.dump({"journal": True}, f)
+        event = {"session_id": "s1", "prompt": "p", "cwd": "/p", "hook_event_name": "UserPromptSubmit"}
+        with patch.object(sys, "argv", ["ccnotify.py", "UserPromptSubmit"]), \
+             patch.object(sys, "stdin", io.StringIO(json.dumps(event))), \
+             patch("ccnotify.spawn_detached") as spawn:
+            ccnotify.main()
+        spawn.assert_called_once_with("fold")
+        self.assertFalse(os.path.exists(self.db_path))
+
+        with open(self.journal, "rb") as f:
+            ccnotify.read_journal_header(f)
+            event_name, data = ccnotify.parse_journal_record(f.readline())
+        self.assertEqual((event_name, data["session_id"]), ("UserPromptSubmit", "s1"))
+        self.assertIsInstance(data["timestamp"], float)
+
+    def test_fold_applies_each_record_exactly_once(self):
+        for event_name, data in self.events():
+            ccnotify.append_journal(event_name, data)
+        tracker = self.tracker()
+        self.assertEqual(tracker.fold_journal(batch_size=4), 6)
+        self.assertEqual(tracker.fold_journal(), 0)
+        for event_name, data in self.events("s2", jobs=1):
+            ccnotify.append_journal(event_name, data)
+        self.assertEqual(tracker.fold_journal(), 2)
+
+        rows = self.fetch_rows("SELECT session_id, seq, stoped_at IS NOT NULL FROM prompt ORDER BY id")
+        self.assertEqual(rows, [("s1", 1, 1), ("s1", 2, 1), ("s1", 3, 1), ("s2", 1, 1)])
+        _, offset = tracker._journal_position()
+        self.assertEqual(offset, os.path.getsize(self.journal))
+
+    def test_crash_mid_batch_resumes_without_duplicates(self):
+        for event_name, data in self.events(jobs=4):
+            ccnotify.append_journal(event_name, data)
+        tracker = self.tracker()
+        original = tracker.handle_event
+        calls = []
+
+        def crash_on_sixth(event_name, data, timer=None):
+            calls.append(event_name)
+            if len(calls) == 6:
+                raise KeyboardInterrupt  # Process killed mid-batch
+            return original(event_name, data, timer)
+
+        with patch.object(tracker, "handle_event", side_effect=crash_on_sixth):
+            with self.assertRaises(KeyboardInterrupt):
+                tracker.fold_journal(batch_size=4)
+        # The first batch committed with its offset; the second rolled back
+        self.assertEqual(len(self.fetch_rows("SELECT id FROM prompt")), 2)
+
+        self.assertEqual(tracker.fold_journal(batch_size=4), 4)
+        self.assertEqual(self.fetch_rows("SELECT MAX(seq), COUNT(stoped_at) FROM prompt"), [(4, 4)])
+
+    def test_corrupt_records_are_skipped_and_partial_ones_wait(self):
+        ccnotify.append_journal(*next(self.events()))
+        with open(self.journal, "ab") as f:
+            f.write(b"00000000 {\"event\": \"Stop\"}\n")
+            f.write(ccnotify.journal_record("Stop", {"session_id": "s1", "hook_event_name": "Stop"})[:-5])
+        tracker = self.tracker()
+        with self.assertLogs(level="ERROR"):
+            self.assertEqual(tracker.fold_journal(), 1)
+        self.assertEqual(self.fetch_rows("SELECT COUNT(stoped_at) FROM prompt"), [(0,)])
+
+        # The writer finishes its record
+        record = ccnotify.journal_record("Stop", {"session_id": "s1", "hook_event_name": "Stop"})
+        with open(self.journal, "ab") as f:
+            f.write(record[-5:])
+        self.assertEqual(tracker.fold_journal(), 1)
+        self.assertEqual(self.fetch_rows("SELECT COUNT(stoped_at) FROM prompt"), [(1,)])
+
+    def test_compaction_starts_a_new_journal(self):
+        for event_name, data in self.events(jobs=1):
+            ccnotify.append_journal(event_name, data)
+        tracker = self.tracker()
+        with patch.object(ccnotify, "JOURNAL_COMPACT_BYTES", 1):
+            tracker.fold_journal()
+        self.assertFalse(os.path.exists(self.journal))
+
+        for event_name, data in self.events(jobs=1):
+            ccnotify.append_journal(event_name, data)
+        self.assertEqual(tracker.fold_journal(), 2)
+        self.assertEqual(self.fetch_rows("SELECT seq FROM prompt ORDER BY id"), [(1,), (2,)])
+
+    def test_concurrent_appends_from_many_processes(self):
+        import subprocess
+
+        code = (
+            "import sys; sys.path.insert(0, {root!r}); import ccnotify\n"
+            "for i in range(50):\n"
+            "    ccnotify.append_journal('UserPromptSubmit', {{'session_id': 's' + sys.argv[1],"
+            " 'prompt': 'x' * 3000, 'cwd': '/p', 'hook_event_name': 'UserPromptSubmit'}})\n"
+        ).format(root=str(Path(__file__).parent.parent))
+        procs = [subprocess.Popen([sys.executable, "-c", code, str(n)]) for n in range(4)]
+        for proc in procs:
+            self.assertEqual(proc.wait(), 0)
+        self.assertEqual(self.tracker().fold_journal(), 200)
+        self.assertEqual(self.fetch_rows("SELECT COUNT(DISTINCT session_id), MAX(seq) FROM prompt"), [(4, 50)])
+
+
+class TestIngest(TrackerTestCase):
+    def events(self):
+        lines = []
+        for path in sorted(Path(__file__).parent.glob("test_data/scenario_*.json")):
+            lines.extend(json.dumps(event) for event in json.loads(path.read_text()))
+        return lines
+
+    def test_replays_scenarios_without_notifying(self):
+        tracker = ClaudePromptTracker()
+        tracker.notifications_enabled = False
+        lines = self.events() + ["not json", json.dumps({"hook_event_name": "Bogus"}), ""]
+
+        with patch("subprocess.run") as mock_run:
+            applied, skipped = tracker.ingest_events(lines, batch_size=4)
+        mock_run.assert_not_called()
+        self.assertEqual(applied, len(self.events()))
+        self.assertEqual(skipped, 2)
+
+        rows = self.fetch_rows("SELECT seq FROM prompt WHERE session_id = 'session_003' ORDER BY seq")
+        self.assertEqual(rows, [(1,), (2,), (3,)])
+        self.assertEqual(self.fetch_rows("SELECT COUNT(*) FROM prompt WHERE stoped_at IS NULL"), [(3,)])
+
+    def test_event_timestamps_are_kept(self):
+        tracker = ClaudePromptTracker()
+        tracker.notifications_enabled = False
+        tracker.ingest_events([
+            json.dumps({"session_id": "s1", "prompt": "p", "cwd": "/p", "hook_event_name": "UserPromptSubmit",
+                        "timestamp": "2025-03-01T10:00:00.250+02:00"}),
+            json.dumps({"session_id": "s1", "hook_event_name": "Stop", "timestamp": "2025-03-01T08:02:30Z"}),
+        ])
+        self.assertEqual(
+            self.fetch_rows("SELECT created_at, stoped_at FROM prompt"),
+            [("2025-03-01 08:00:00", "2025-03-01 08:02:30")],
+        )
+
+    def test_failing_event_does_not_lose_batch(self):
+        tracker = ClaudePromptTracker()
+        tracker.notifications_enabled = False
+        original = tracker.handle_user_prompt_submit
+
+        def flaky(data):
+            original(data)
+            if data["prompt"] == "bad":
+                raise RuntimeError("boom")
+
+        with patch.object(tracker, "handle_user_prompt_submit", side_effect=flaky):
+            applied, skipped = tracker.ingest_events(
+                json.dumps({"session_id": "s1", "prompt": p, "cwd": "/p", "hook_event_name": "UserPromptSubmit"})
+                for p in ("one", "bad", "two")
+            )
+        self.assertEqual((applied, skipped), (2, 1))
+        self.assertEqual(self.fetch_rows("SELECT prompt FROM prompt ORDER BY id"), [("one",), ("two",)])
+
+    def test_notifications_wait_for_commit(self):
+        tracker = ClaudePromptTracker()
+        self.submit(tracker, "s1")
+        sent = []
+        with patch.object(tracker, "send_notification", side_effect=lambda *a, **k: sent.append(tracker._tx_depth)):
+            with tracker.transaction():
+                tracker.handle_event("Stop", {"session_id": "s1", "hook_event_name": "Stop"})
+                self.assertEqual(sent, [])
+        self.assertEqual(sent, [0])
+
+
+class TestBackfill(TrackerTestCase):
+    SESSION = "5f0c6a52-0000-4000-8000-000000000001"
+
+    def entry(self, kind, timestamp, content, **extra):
+        entry = {
+            "type": kind,
+            "sessionId": self.SESSION,
+            "cwd": "/Users/dev/projects/api",
+            "timestamp": timestamp,
+            "message": {"role": kind, "content": content},
+        }
+        entry.update(extra)
+        return json.dumps(entry, ensure_ascii=False) + "\n"
+
+    def write(self, path, lines, mode="a"):
+        with open(path, mode, encoding="utf-8") as f:
+            f.writelines(lines)
+
+    def test_reconstructs_jobs_and_resumes(self):
+        path = os.path.join(self.temp_dir, f"{self.SESSION}.jsonl")
+        self.write(path, [
+            json.dumps({"type": "summary", "summary": "API work"}) + "\n",
+            self.entry("user", "2025-05-01T09:00:00.000Z", "添加登录接口"),
+            self.entry("assistant", "2025-05-01T09:00:05.000Z", [{"type": "text", "text": "ok"}]),
+            self.entry("user", "2025-05-01T09:00:06.000Z", [{"type": "tool_result", "content": "x"}]),
+            self.entry("user", "2025-05-01T09:00:07.000Z", "caveat", isMeta=True),
+            self.entry("assistant", "2025-05-01T09:01:30.000Z", [{"type": "text", "text": "done"}]),
+            self.entry("user", "2025-05-01T09:05:00.000Z", [{"type": "text", "text": "write tests"}]),
+            self.entry("assistant", "2025-05-01T09:06:00.000Z", [{"type": "text", "text": "..."}]),
+        ])
+        tracker = ClaudePromptTracker()
+        self.assertEqual(tracker.backfill_transcript(path), 2)
+        # Unchanged file is skipped entirely
+        self.assertEqual(tracker.backfill_transcript(path), 0)
+
+        # The last job keeps running and a new one starts; a partial line is left for later
+        self.write(path, [
+            self.entry("assistant", "2025-05-01T09:09:00.000Z", [{"type": "text", "text": "more"}]),
+            self.entry("user", "2025-05-01T09:10:00.000Z", "third"),
+            '{"type": "assistant", "timestamp": "2025-05-01T09:11',
+        ])
+        self.assertEqual(tracker.backfill_transcript(path), 1)
+
+        rows = self.fetch_rows("SELECT seq, prompt, created_at, stoped_at FROM prompt ORDER BY seq")
+        self.assertEqual(rows, [
+            (1, "添加登录接口", "2025-05-01 09:00:00", "2025-05-01 09:01:30"),
+            (2, "write tests", "2025-05-01 09:05:00", "2025-05-01 09:09:00"),
+            (3, "third", "2025-05-01 09:10:00", None),
+        ])
+
+    def test_skips_prompts_recorded_by_hooks_and_renumbers_seq(self):
+        tracker = ClaudePromptTracker()
+        tracker.notifications_enabled = False
+        tracker.ingest_events([json.dumps({
+            "session_id": self.SESSION, "prompt": "second", "cwd": "/p",
+            "hook_event_name": "UserPromptSubmit", "timestamp": "2025-05-01T09:05:01Z",
+        })])
+
+        path = os.path.join(self.temp_dir, "t.jsonl")
+        self.write(path, [
+            self.entry("user", "2025-05-01T09:00:00.000Z", "first"),
+            self.entry("assistant", "2025-05-01T09:01:00.000Z", "a"),
+            self.entry("user", "2025-05-01T09:05:00.000Z", "second"),
+        ])
+        self.assertEqual(tracker.backfill_transcript(path), 1)
+        self.assertEqual(
+            self.fetch_rows("SELECT seq, prompt FROM prompt ORDER BY seq"),
+            [(1, "first"), (2, "second")],
+        )
+
+
+class TestRetention(TrackerTestCase):
+    def seed(self, tracker):
+        tracker.notifications_enabled = False
+        events = []
+        for day, cwd, minutes in [(40, "/p/api", 2), (40, "/p/api", 10), (35, "/p/web", 1), (1, "/p/api", 3)]:
+            session_id = f"s{day}{cwd}"
+            start = f"-{day} days"
+            events.append({"session_id": session_id, "prompt": "x" * 20000, "cwd": cwd,
+                           "hook_event_name": "UserPromptSubmit", "timestamp": self.ts(start)})
+            events.append({"session_id": session_id, "hook_event_name": "Stop",
+                           "timestamp": self.ts(start, f"+{minutes} minutes")})
+        # An old job that never finished
+        events.append({"session_id": "open", "prompt": "p", "cwd": "/p/web",
+                       "hook_event_name": "UserPromptSubmit", "timestamp": self.ts("-35 days")})
+        tracker.ingest_events(json.dumps(e) for e in events)
+
+    def ts(self, *modifiers):
+        with sqlite3.connect(":memory:") as conn:
+            return conn.execute("SELECT datetime('now', 'start of day', '+12 hours', " +
+                                ", ".join("?" * len(modifiers)) + ")", modifiers).fetchone()[0] + "Z"
+
+    def test_old_rows_are_folded_into_daily_aggregates(self):
+        tracker = ClaudePromptTracker()
+        self.seed(tracker)
+        self.assertEqual(tracker.apply_retention(30, chunk_size=2), 4)
+
+        self.assertEqual(self.fetch_rows("SELECT cwd FROM prompt"), [("/p/api",)])
+        rows = self.fetch_rows("""
+            SELECT cwd, job_count, finished_count, total_duration, min_duration, max_duration
+            FROM prompt_daily ORDER BY day, cwd
+        """)
+        # Recent jobs are in the rollups from Stop; folding adds only the open job
+        self.assertEqual(rows, [("/p/api", 2, 2, 720, 120, 600), ("/p/web", 2, 1, 60, 60, 60),
+                                ("/p/api", 1, 1, 180, 180, 180)])
+
+        # Nothing left to fold on a second run
+        self.assertEqual(tracker.apply_retention(30), 0)
+
+    def test_incremental_vacuum_reclaims_space(self):
+        tracker = ClaudePromptTracker()
+        self.assertEqual(tracker.conn.execute("PRAGMA auto_vacuum").fetchone()[0], 2)
+        self.seed(tracker)
+        tracker.apply_retention(30, vacuum_pages=0)
+        self.assertGreater(tracker.conn.execute("PRAGMA freelist_count").fetchone()[0], 0)
+        tracker.apply_retention(30)
+        self.assertEqual(tracker.conn.execute("PRAGMA freelist_count").fetchone()[0], 0)
+
+    def test_stop_schedules_prune_once_a_day(self):
+        with open(os.path.join(self.temp_dir, ccnotify.CONFIG_NAME), "w") as f:
+            json.dump({"retention_days": 30}, f)
+        tracker = ClaudePromptTracker()
+        tracker.notifications_enabled = False
+        with patch("ccnotify.spawn_detached") as spawn:
+            for _ in range(2):
+                self.submit(tracker, "s1")
+                tracker.handle_event("Stop", {"session_id": "s1", "hook_event_name": "Stop"})
+        spawn.assert_called_once_with("prune", "--auto")
+
+
+class TestStats(TrackerTestCase):
+    def replay(self, tracker, events):
+        tracker.notifications_enabled = False
+        tracker.ingest_events(json.dumps(e) for e in events)
+
+    def job(self, session_id, cwd, start, seconds, waited=None):
+        base = datetime(2026, 10, 18, 9, 0, tzinfo=timezone.utc).timestamp() + start
+        events = [{"session_id": session_id, "prompt": "p", "cwd": cwd,
+                   "hook_event_name": "UserPromptSubmit", "timestamp": base}]
+        if waited is not None:
+            events.append({"session_id": session_id, "hook_event_name": "Notification",
+                           "message": "Claude is waiting for your input", "timestamp": base + waited})
+        events.append({"session_id": session_id, "hook_event_name": "Stop", "timestamp": base + seconds})
+        return events
+
+    def test_stop_updates_rollups_incrementally(self):
+        tracker = ClaudePromptTracker()
+        events = []
+        for i, seconds in enumerate([30, 60, 90, 600]):
+            events += self.job(f"s{i}", "/p/api", i * 1000, seconds)
+        self.replay(tracker, events)
+        rows = self.fetch_rows("""
+            SELECT cwd, job_count, finished_count, total_duration, min_duration, max_duration
+            FROM prompt_daily
+        """)
+        self.assertEqual(rows, [("/p/api", 4, 4, 780, 30, 600)])
+        self.assertEqual(sum(r[0] for r in self.fetch_rows("SELECT count FROM prompt_daily_hist")), 4)
+
+    def test_waiting_time_counts_until_stop_or_next_prompt(self):
+        tracker = ClaudePromptTracker()
+        # Waits 40s inside the job, then the idle notice after Stop lasts until the next prompt
+        events = self.job("s1", "/p/api", 0, 100, waited=60)
+        events.append({"session_id": "s1", "hook_event_name": "Notification",
+                       "message": "Claude is waiting for your input",
+                       "timestamp": events[0]["timestamp"] + 160})
+        events += self.job("s1", "/p/api", 460, 10)
+        self.replay(tracker, events)
+        self.assertEqual(self.fetch_rows("SELECT wait_duration FROM prompt_daily"), [(40 + 300,)])
+
+    def test_query_stats_percentiles_and_filters(self):
+        tracker = ClaudePromptTracker()
+        events = []
+        for i in range(20):
+            events += self.job(f"a{i}", "/p/api", i * 1000, 60 if i < 18 else 3600)
+        events += self.job("w", "/p/web", 0, 5)
+        self.replay(tracker, events)
+        stats = tracker.query_stats(days=100000, project="api")
+        self.assertEqual(len(stats), 1)
+        api = stats[0]
+        self.assertEqual((api["project"], api["jobs"], api["total"]), ("/p/api", 20, 18 * 60 + 2 * 3600))
+        self.assertLessEqual(api["median"], 60)
+        self.assertGreater(api["median"], 45)
+        self.assertGreater(api["p95"], 60)
+        self.assertEqual(len(tracker.query_stats(days=100000)), 2)
+
+    def test_existing_history_is_rolled_up_once(self):
+        tracker = ClaudePromptTracker()
+        self.replay(tracker, self.job("s1", "/p/api", 0, 30))
+        with tracker.transaction() as conn:
+            conn.execute("DELETE FROM prompt_daily")
+            conn.execute("DELETE FROM prompt_daily_hist")
+            conn.execute("DELETE FROM meta WHERE key = 'rollups_built'")
+            conn.execute("PRAGMA user_version = 0")
+        ClaudePromptTracker()
+        ClaudePromptTracker()
+        self.assertEqual(self.fetch_rows("SELECT finished_count, total_duration FROM prompt_daily"), [(1, 30)])
+
+    def test_stats_command_json(self):
+        self.replay(ClaudePromptTracker(), self.job("s1", "/p/api", 0, 30))
+        with patch("sys.stdout", new_callable=io.StringIO) as out:
+            ccnotify.command_stats(["--days", "100000", "--json"])
+        self.assertEqual(json.loads(out.getvalue())[0]["jobs"], 1)
+
+
+class TestTimings(TrackerTestCase):
+    def run_hook(self, event):
+        with patch.object(sys, "argv", ["ccnotify.py", event["hook_event_name"]]), \
+             patch.object(sys, "stdin", io.StringIO(json.dumps(event))):
+            ccnotify.main()
+
+    def test_main_records_phases_per_event(self):
+        with patch("subprocess.run") as mock_run:
+            mock_run.return_value.returncode = 0
+            self.run_hook({"session_id": "s1", "prompt": "p", "cwd": "/p", "hook_event_name": "UserPromptSubmit"})
+            self.run_hook({"session_id": "s1", "hook_event_name": "Stop"})
+
+        rows = self.fetch_rows("""
+            SELECT event, session_id, total_us, parse_us + validate_us + init_us + db_us + env_us + notify_us,
+                   init_us, db_us, notify_us
+            FROM event_timing ORDER BY id
+        """)
+        self.assertEqual([(r[0], r[1]) for r in rows], [("UserPromptSubmit", "s1"), ("Stop", "s1")])
+        for _, _, total, phases, init, db, _ in rows:
+            self.assertGreater(init, 0)
+            self.assertGreater(db, 0)
+            self.assertGreaterEqual(total, phases)
+        self.assertGreater(rows[1][6], 0)
+
+    def test_nested_phases_are_exclusive(self):
+        timer = ccnotify.EventTimer()
+        with patch("ccnotify.time.perf_counter", side_effect=[0.0, 1.0, 3.0, 4.0]):
+            with timer.phase("notify"):
+                with timer.phase("env"):
+                    pass
+        self.assertEqual(timer.phases, {"notify": 2.0, "env": 2.0})
+
+    def test_ingest_and_disabled_timing_record_nothing(self):
+        tracker = ClaudePromptTracker()
+        tracker.notifications_enabled = False
+        tracker.ingest_events([json.dumps({"session_id": "s1", "prompt": "p", "cwd": "/p",
+                                           "hook_event_name": "UserPromptSubmit"})])
+        tracker.config["timing"] = False
+        tracker.handle_event("Stop", {"session_id": "s1", "hook_event_name": "Stop"}, ccnotify.EventTimer())
+        self.assertEqual(self.fetch_rows("SELECT COUNT(*) FROM event_timing"), [(0,)])
+
+    def test_query_lists_slowest_events_and_phase_summary(self):
+        tracker = ClaudePromptTracker()
+        with tracker.transaction() as conn:
+            conn.executemany(
+                "INSERT INTO event_timing (session_id, event, total_us, db_us, notify_us) VALUES (?, ?, ?, ?, ?)",
+                [("s1", "Stop", 90000, 1000, 85000), ("s2", "Stop", 10000, 2000, 7000),
+                 ("s3", "UserPromptSubmit", 3000, 1500, 0)],
+            )
+            conn.execute(
+                "INSERT INTO event_timing (recorded_at, event, total_us) VALUES (datetime('now', '-2 days'), 'Stop', 999000)"
+            )
+        slowest, summary = tracker.query_timings(hours=24, limit=2)
+        self.assertEqual([(r["session_id"], r["total"], r["notify"]) for r in slowest],
+                         [("s1", 90.0, 85.0), ("s2", 10.0, 7.0)])
+        stop = next(r for r in summary if r["event"] == "Stop")
+        self.assertEqual((stop["count"], stop["db"]["avg"], stop["total"]["max"]), (2, 1.5, 90.0))
+
+        with patch("sys.stdout", new_callable=io.StringIO) as out:
+            ccnotify.command_timings(["--event", "UserPromptSubmit", "--json"])
+        self.assertEqual([r["session_id"] for r in json.loads(out.getvalue())["slowest"]], ["s3"])
+
+
+class TestQueryPlans(TrackerTestCase):
+    """Hot-path lookups must search an index, never scan prompt"""
+
+    def plan(self, sql, params=("session_001",)):
+        conn = ClaudePromptTracker().conn
+        return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+
+    def assert_no_scan(self, plan):
+        for step in plan:
+            self.assertNotIn("SCAN", step, plan)
+            self.assertNotIn("TEMP B-TREE", step, plan)
+
+    def test_stop_lookup_uses_open_prompt_index(self):
+        plan = self.plan(ccnotify.LATEST_OPEN_PROMPT_SQL)
+        self.assert_no_scan(plan)
+        self.assertTrue(any("idx_prompt_session_open" in step for step in plan), plan)
+
+    def test_waiting_update_uses_session_index(self):
+        plan = self.plan(ccnotify.MARK_WAITING_SQL, (None, "session_001"))
+        self.assert_no_scan(plan)
+        self.assertTrue(any("idx_prompt_session_created" in step for step in plan), plan)
+
+    def test_seq_trigger_subquery_uses_seq_index(self):
+        # Same subquery as the auto_increment_seq trigger body
+        plan = self.plan("SELECT COALESCE(MAX(seq), 0) + 1 FROM prompt WHERE session_id = ?")
+        self.assert_no_scan(plan)
+        self.assertTrue(any("idx_prompt_session_seq" in step for step in plan), plan)
+
+    def test_queue_lookup_uses_pending_index(self):
+        plan = self.plan(
+            """
+            SELECT id FROM notification_queue
+            WHERE status = 'pending' AND next_attempt_at <= CURRENT_TIMESTAMP
+            ORDER BY id LIMIT 1
+            """,
+            (),
+        )
+        self.assertTrue(any("idx_notification_queue_pending" in step for step in plan), plan)
+
+
+class TestDaemon(TrackerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.socket_path = os.path.join(self.temp_dir, ccnotify.SOCKET_NAME)
+        self.daemon = CCNotifyDaemon(self.socket_path)
+        self.daemon.start()
+
+    def tearDown(self):
+        self.daemon.stop()
+        super().tearDown()
+
+    def test_forwarded_events_are_applied_in_order(self):
+        submit = {
+            "session_id": "session_001",
+            "prompt": "创建一个Python脚本",
+            "cwd": "/Users/dev/projects/my-app",
+            "hook_event_name": "UserPromptSubmit",
+        }
+        stop = {"session_id": "session_001", "hook_event_name": "Stop"}
+
+        with patch("subprocess.run") as mock_run:
+            self.assertTrue(
+                forward_to_daemon("UserPromptSubmit", json.dumps(submit), self.socket_path)
+            )
+            self.assertTrue(forward_to_daemon("Stop", json.dumps(stop), self.socket_path))
+            self.daemon.stop()
+
+        rows = self.fetch_rows("SELECT seq, stoped_at FROM prompt")
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0][0], 1)
+        self.assertIsNotNone(rows[0][1])
+        self.assertTrue(mock_run.called)
+
+    def test_invalid_payload_is_rejected(self):
+        with self.assertRaises(ValueError):
+            forward_to_daemon("Stop", "not json", self.socket_path)
+        with self.assertRaises(ValueError):
+            forward_to_daemon("Stop", json.dumps({"hook_event_name": "Stop"}), self.socket_path)
+
+    def test_no_daemon_falls_back(self):
+        missing = os.path.join(self.temp_dir, "missing.sock")
+        self.assertFalse(forward_to_daemon("Stop", "{}", missing))
+
+    def test_refuses_to_start_twice(self):
+        with self.assertRaises(RuntimeError):
+            CCNotifyDaemon(self.socket_path, tracker=self.daemon.tracker).start()
+
+
+class TestStartup(TrackerTestCase):
+    """Paths that do no tracking work must not import the heavy modules"""
+
+    SCRIPT = str(Path(__file__).parent.parent / "ccnotify.py")
+    HEAVY = {"sqlite3", "subprocess", "datetime", "logging", "logging.handlers"}
+    # Cumulative -X importtime of `import ccnotify`, in microseconds
+    IMPORT_BUDGET_US = 20000
+
+    def imported(self, *args, stdin=""):
+        import subprocess
+
+        # Hooks run from a cached .pyc; keep one under temp_dir even when
+        # bytecode writing is disabled for the test run
+        env = dict(os.environ, PYTHONPYCACHEPREFIX=os.path.join(self.temp_dir, "pycache"))
+        env.pop("PYTHONDONTWRITEBYTECODE", None)
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", *args],
+            input=stdin, capture_output=True, text=True, cwd=self.temp_dir, env=env,
+        )
+        modules = {}
+        for line in result.stderr.splitlines():
+            if line.startswith("import time:") and "|" in line:
+                _, cumulative, name = line.split("|")
+                if cumulative.strip().isdigit():
+                    modules[name.strip()] = int(cumulative)
+        return result, modules
+
+    def test_probe_and_invalid_hook_skip_heavy_imports(self):
+        result, modules = self.imported(self.SCRIPT)
+        self.assertEqual(result.stdout.strip(), "ok")
+        self.assertFalse((self.HEAVY | {"json"}) & modules.keys())
+
+        result, modules = self.imported(self.SCRIPT, "Bogus")
+        self.assertEqual(result.returncode, 1)
+        self.assertIn("Invalid hook type", result.stderr)
+        self.assertFalse({"sqlite3", "subprocess", "datetime", "logging.handlers"} & modules.keys())
+
+    def test_forwarded_hook_skips_database_and_logging(self):
+        daemon = CCNotifyDaemon(os.path.join(self.temp_dir, ccnotify.SOCKET_NAME))
+        daemon.start()
+        try:
+            event = {"session_id": "s1", "prompt": "p", "cwd": "/p", "hook_event_name": "UserPromptSubmit"}
+            result, modules = self.imported(self.SCRIPT, "UserPromptSubmit", stdin=json.dumps(event))
+        finally:
+            daemon.stop()
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn("socket", modules)
+        self.assertFalse(self.HEAVY & modules.keys())
+        self.assertEqual(len(self.fetch_rows("SELECT id FROM prompt")), 1)
+
+    def test_import_time_budget(self):
+        path = str(Path(self.SCRIPT).parent)
+        code = f"import sys; sys.path.insert(0, {path!r}); import ccnotify"
+        self.imported("-c", code)  # Writes the .pyc
+        # Best of three to ride out a cold disk cache
+        best = min(self.imported("-c", code)[1]["ccnotify"] for _ in range(3))
+        self.assertLess(best, self.IMPORT_BUDGET_US)
+
+
+class TestProcessTable(TrackerTestCase):
+    def make_proc(self, root, pid, ppid, comm, cmdline, cwd, tty_nr=0):
+        proc_dir = os.path.join(root, str(pid))
+        os.makedirs(proc_dir)
+        with open(os.path.join(proc_dir, "stat"), "w") as f:
+            f.write(f"{pid} ({comm}) S {ppid} {pid} {pid} {tty_nr} 0 0\n")
+        with open(os.path.join(proc_dir, "cmdline"), "wb") as f:
+            f.write(cmdline.replace(" ", "\0").encode() + b"\0")
+        os.symlink(cwd, os.path.join(proc_dir, "cwd"))
+
+    def fake_procfs(self):
+        root = os.path.join(self.temp_dir, "proc")
+        os.makedirs(os.path.join(root, "self"))
+        self.make_proc(root, 100, 1, "Code Helper", "/Applications/Code Helper", "/")
+        self.make_proc(root, 200, 100, "zsh", "-zsh", "/Users/dev", tty_nr=34816 + 3)
+        self.make_proc(root, 300, 200, "node", "node /usr/local/bin/claude", "/Users/dev/api", tty_nr=34816 + 3)
+        self.make_proc(root, 400, 1, "node", "node /usr/local/bin/claude", "/Users/dev/web")
+        return root
+
+    def test_procfs_snapshot(self):
+        table = ProcessTable.snapshot(self.fake_procfs())
+        self.assertEqual(sorted(table.find_claude_pids()), [300, 400])
+        self.assertEqual(table.ancestors(300), [200, 100])
+        self.assertEqual(table.cwd(300), "/Users/dev/api")
+        self.assertEqual(table.tty(300), "pts/3")
+        self.assertEqual(table.comm(100), "Code Helper")
+
+    def test_detect_environment_uses_snapshot(self):
+        root = self.fake_procfs()
+        tracker = ClaudePromptTracker()
+        with patch.object(ProcessTable, "snapshot", lambda: ProcessTable.from_procfs(root)):
+            self.assertEqual(tracker.detect_claude_environment("/Users/dev/api")["type"], "vscode")
+            env = tracker.detect_claude_environment("/Users/dev/web")
+            self.assertEqual(env["type"], "terminal")
+            self.assertEqual(tracker.detect_claude_environment("/nowhere")["type"], "unknown")
+
+    def test_ps_fallback_batches_lsof(self):
+        outputs = {
+            "pid=,ppid=,tty=,comm=": " 10 1 ?? /Applications/Visual Studio Code.app/Contents/MacOS/Electron\n"
+                                     " 20 10 ttys003 /bin/zsh\n"
+                                     " 30 20 ttys003 node\n",
+            "pid=,args=": " 10 Electron\n 20 -zsh\n 30 node /usr/local/bin/claude\n",
+        }
+
+        def fake_run(cmd, **kwargs):
+            result = MagicMock()
+            if cmd[0] == "ps":
+                result.stdout = outputs[cmd[-1]]
+            else:
+                result.stdout = "p30\nfcwd\nn/Users/dev/api\n"
+            return result
+
+        with patch("subprocess.run", side_effect=fake_run) as mock_run:
+            table = ProcessTable.from_ps()
+            self.assertEqual(table.find_claude_pids(), [30])
+            self.assertEqual(table.cwd(30), "/Users/dev/api")
+            self.assertEqual(table.ancestors(30), [20, 10])
+            self.assertIn("Electron", table.comm(10))
+        self.assertEqual(mock_run.call_count, 3)
+
+
+class TestEnvironmentCache(TrackerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.tracker = ClaudePromptTracker()
+        self.detected = {"type": "terminal", "tty": "ttys003", "cwd": "/p", "pid": os.getpid()}
+
+    def test_repeat_lookup_skips_detection(self):
+        with patch.object(self.tracker, "detect_claude_environment", return_value=self.detected) as detect:
+            first = self.tracker.resolve_environment("/p", "s1")
+            second = self.tracker.resolve_environment("/p", "s1")
+        self.assertEqual(detect.call_count, 1)
+        self.assertEqual(second["tty"], "ttys003")
+        self.assertEqual(first["type"], second["type"])
+
+    def test_expired_or_dead_entries_are_ignored(self):
+        with patch.object(self.tracker, "detect_claude_environment", return_value=self.detected) as detect:
+            self.tracker.resolve_environment("/p", "s1")
+            with sqlite3.connect(self.db_path) as conn:
+                conn.execute("UPDATE env_cache SET detected_at = datetime('now', '-1 day')")
+            self.tracker.resolve_environment("/p", "s1")
+            self.assertEqual(detect.call_count, 2)
+
+            with patch("ccnotify.pid_alive", return_value=False):
+                self.tracker.resolve_environment("/p", "s1")
+            self.assertEqual(detect.call_count, 3)
+
+    def test_unknown_results_are_not_cached(self):
+        unknown = {"type": "unknown", "cwd": "/p"}
+        with patch.object(self.tracker, "detect_claude_environment", return_value=unknown) as detect:
+            self.tracker.resolve_environment("/p", "s1")
+            self.tracker.resolve_environment("/p", "s1")
+        self.assertEqual(detect.call_count, 2)
+
+
+class TestDeliveryQueue(TrackerTestCase):
+    def setUp(self):
+        super().setUp()
+        with open(os.path.join(self.temp_dir, ccnotify.CONFIG_NAME), "w") as f:
+            json.dump({"delivery": "queue", "delivery_max_attempts": 2}, f)
+        self.tracker = ClaudePromptTracker()
+        self.unknown_env = patch.object(
+            self.tracker, "resolve_environment", return_value={"type": "unknown", "cwd": "/p"}
+        )
+        self.unknown_env.start()
+
+    def tearDown(self):
+        self.unknown_env.stop()
+        super().tearDown()
+
+    def queue_rows(self):
+        return self.fetch_rows("SELECT status, attempts, title FROM notification_queue ORDER BY id")
+
+    def test_handlers_enqueue_without_notifying(self):
+        self.submit(self.tracker, "s1", cwd="/Users/dev/projects/api")
+        with patch("subprocess.run") as mock_run, patch("ccnotify.spawn_detached") as spawn:
+            self.tracker.handle_event("Stop", {"session_id": "s1", "hook_event_name": "Stop"})
+        mock_run.assert_not_called()
+        spawn.assert_called_once_with("deliver")
+        self.assertEqual(self.queue_rows(), [("pending", 0, "api")])
+
+        with patch("subprocess.run") as mock_run:
+            mock_run.return_value.returncode = 0
+            self.assertEqual(self.tracker.drain_notification_queue(max_wait=0), 1)
+        self.assertEqual(mock_run.call_args[0][0][0], "terminal-notifier")
+        self.assertEqual(self.queue_rows(), [("delivered", 1, "api")])
+
+    def test_failed_delivery_is_retried_then_marked_failed(self):
+        with patch("ccnotify.spawn_detached"):
+            self.tracker.notify("api", "Permission Required", "/p", "s1")
+
+        with patch("subprocess.run", side_effect=RuntimeError("boom")):
+            self.tracker.drain_notification_queue(max_wait=0)
+            self.assertEqual(self.queue_rows(), [("pending", 1, "api")])
+            with sqlite3.connect(self.db_path) as conn:
+                conn.execute("UPDATE notification_queue SET next_attempt_at = CURRENT_TIMESTAMP")
+            self.tracker.drain_notification_queue(max_wait=0)
+        self.assertEqual(self.queue_rows(), [("failed", 2, "api")])
+
+    def test_missing_notifier_is_not_retried(self):
+        with patch("ccnotify.spawn_detached"):
+            self.tracker.notify("api", "Notification", "/p", "s1")
+        with patch("subprocess.run", side_effect=FileNotFoundError("terminal-notifier")):
+            self.tracker.drain_notification_queue(max_wait=0)
+        self.assertEqual(self.queue_rows(), [("failed", 1, "api")])
+
+
+if __name__ == "__main__":
+    unittest.main()